@@ -1,86 +1,176 @@
 # audio_utils.py
 
+import asyncio
 import os
-import numpy as np
-from scipy.signal import butter, filtfilt
-from pydub import AudioSegment
-import noisereduce as nr
+from audio.pipeline import (
+    DEFAULT_STEPS,
+    STEP_DESCRIPTIONS,
+    decode_audio,
+    encode_audio,
+    apply_stage,
+    resolve_params,
+    validate_steps,
+)
+from audio.filters import apply_filter
+from audio.denoise import NoiseProfile, estimate_noise_profile, usable_profile, load_noise_profile, save_noise_profile
+from audio.ffmpeg_io import probe_audio, describe_source
+from audio.encoding import DEFAULT_PROFILE, get_profile, encode_source
+from audio.streaming import stream_process_file
 from utils import logger
-from bot.bot_utils import send_log_to_user, send_audio_to_user
+from utils.executor import get_executor, JobQueueFullError, JobTimeoutError
+from utils.workspace import safe_filename
+from utils.profile_store import get_profile_store
+from utils.progress import NullProgress
+from utils.metrics import StageTimer, record_stage_timings
 
-async def butter_filter(data, lowcut, highcut, fs, btype='low'):
+# Oltre questa durata la pulizia avviene a blocchi, con memoria di picco costante
+STREAMING_THRESHOLD_SECONDS = float(os.getenv('STREAMING_THRESHOLD_SECONDS', 600))
+
+def butter_filter(data, lowcut, highcut, fs, btype='low'):
     try:
-        nyq = 0.5 * fs
-        low = lowcut / nyq
-        high = highcut / nyq
-        b, a = butter(4, [low, high], btype=btype if btype == 'band' else btype)
-        return filtfilt(b, a, data)
+        # Il filtro passa-alto usa il taglio inferiore, il passa-basso quello superiore
+        if btype in ('band', 'bandpass', 'bandstop'):
+            cutoff = [lowcut, highcut]
+        elif btype in ('high', 'highpass'):
+            cutoff = lowcut
+        else:
+            cutoff = highcut
+        return apply_filter(data, cutoff, fs, btype=btype)
     except Exception as e:
         logger.error(f"Errore durante l'applicazione del filtro Butterworth: {e}")
         return None
 
-async def clean_audio(bot, file_path, output_filename, user_id, step='final'):
+# Pulizia completa di un file: eseguita nei processi worker dell'executor
+def clean_file(source, output_path, steps=DEFAULT_STEPS, params=None, streaming=None, noise_profile=None,
+               output_profile=DEFAULT_PROFILE, duration=None):
+    """
+    Pulisce `source` (percorso o byte del file) e scrive il risultato in `output_path`,
+    codificato secondo `output_profile` (vedi `audio.encoding.PROFILES`).
+    `noise_profile` sono i byte di un `NoiseProfile` già stimato (es. per la stessa aula).
+    `duration` (in secondi, se già nota) evita di ricavarla con ffprobe.
+    Restituisce (percorso di output, byte del profilo di rumore usato o None,
+    durata in secondi di ogni step), con percorso None se l'audio è vuoto.
+    """
+    steps = validate_steps(steps)
+    params = resolve_params(params)
+    profile = NoiseProfile.from_bytes(noise_profile) if noise_profile else None
+    # Le durate misurate nel worker vengono restituite al processo principale per le metriche
+    timer = StageTimer()
+
+    # Nessuno step modifica l'audio: niente decodifica, e niente ricodifica se il formato è già quello richiesto
+    if not steps:
+        with timer.stage('encode'):
+            output_path, _ = encode_source(source, output_path, output_profile)
+        return output_path, None, timer.timings
+
+    # Registrazioni lunghe: decodifica, filtri e codifica a blocchi tramite ffmpeg
+    if streaming is None:
+        if not duration:
+            with timer.stage('probe'):
+                _, _, duration = probe_audio(source)
+        streaming = duration > STREAMING_THRESHOLD_SECONDS
+    if streaming:
+        output_path, profile = stream_process_file(source, output_path, steps, dict(params, noise_profile=profile),
+                                                   profile=output_profile, timer=timer)
+        return output_path, profile.to_bytes() if profile is not None else None, timer.timings
+
+    # Unica decodifica: tutti gli step lavorano sullo stesso buffer in memoria
+    with timer.stage('decode'):
+        y, sample_rate = decode_audio(source)
+    if len(y) == 0:
+        return None, None, timer.timings
+    for step in steps:
+        with timer.stage(step):
+            # Il profilo viene stimato una sola volta, sul segnale che entra nello step di denoise
+            if step == 'denoise' and not usable_profile(profile, sample_rate):
+                profile = estimate_noise_profile(y, sample_rate)
+            y = apply_stage(step, y, sample_rate, dict(params, noise_profile=profile))
+
+    # Unica codifica finale
+    with timer.stage('encode'):
+        output_path = encode_audio(y, sample_rate, output_path, output_profile)
+    return output_path, profile.to_bytes() if profile is not None else None, timer.timings
+
+# Stima del profilo da un campione di solo rumore: eseguita nei processi worker dell'executor
+def estimate_profile_file(source):
+    """
+    Restituisce i byte del `NoiseProfile` stimato su tutto il campione (non solo
+    sui frame più silenziosi, come per una registrazione), None se l'audio è vuoto.
+    """
+    y, sample_rate = decode_audio(source)
+    if len(y) == 0:
+        return None
+    return estimate_noise_profile(y, sample_rate, quiet_fraction=1.0).to_bytes()
+
+# Salva come profilo dell'ambiente quello stimato da un campione di solo rumore inviato dall'utente
+async def learn_noise_profile(source, environment, owner):
+    """Restituisce True se il profilo è stato salvato."""
     try:
-        noise_factor = 0.2
-        low_cutoff = 300.0
-        high_cutoff = 3000.0
+        profile_bytes = await get_executor().run(estimate_profile_file, source)
+        if profile_bytes is None:
+            return False
+        await asyncio.to_thread(save_noise_profile, get_profile_store(), owner, environment,
+                                NoiseProfile.from_bytes(profile_bytes), 'sample')
+        logger.info(f"Profilo di rumore dal campione salvato per {owner}, ambiente '{environment}'.")
+        return True
+    except Exception as e:
+        logger.error(f"Errore durante la stima del profilo di rumore: {e}")
+        return False
+
+async def clean_audio(source, output_filename, steps=DEFAULT_STEPS, params=None, streaming=None,
+                      output_dir="tmp", environment=None, owner=None, progress=None, output_profile=DEFAULT_PROFILE,
+                      duration=None):
+    """
+    Pulisce `source` (percorso o byte del file) nel process pool e scrive
+    `<output_filename>_cleaned<estensione>` in `output_dir`, nel formato di
+    `output_profile` (di default Opus per le risposte vocali). I messaggi di avanzamento
+    vanno a `progress` (chat Telegram, log o nessuno); `owner` identifica il
+    proprietario dei profili di rumore per ambiente (utente Telegram o CLI);
+    `duration` è la durata in secondi, se già nota (es. dichiarata da Telegram).
+    """
+    progress = progress or NullProgress()
+    try:
+        steps = validate_steps(steps)
+        await progress.log(f"Pulizia dell'audio iniziata per il file: {describe_source(source)}")
+        await progress.log(f"Step richiesti: {', '.join(STEP_DESCRIPTIONS[step] for step in steps) or 'nessuno'}")
+
+        # Il lavoro CPU-bound gira nel process pool: l'event loop resta libero per le altre chat
+        # Con un ambiente di registrazione impostato, il profilo di rumore viene riutilizzato tra i file
+        stored_profile = None
+        if environment and 'denoise' in steps:
+            stored_profile = await asyncio.to_thread(load_noise_profile, get_profile_store(), owner, environment)
+            if stored_profile is not None:
+                await progress.log(f"Uso il profilo di rumore salvato per l'ambiente '{environment}'.")
 
-        await send_log_to_user(bot, user_id, f"Pulizia dell'audio iniziata per il file: {file_path}")
+        extension = get_profile(output_profile).extension
+        final_audio_path = os.path.join(output_dir, safe_filename(f"{output_filename}_cleaned{extension}"))
+        result, profile_bytes, timings = await get_executor().run(
+            clean_file, source, final_audio_path, steps, params, streaming,
+            stored_profile.to_bytes() if stored_profile is not None else None, output_profile, duration,
+        )
+        record_stage_timings(timings)
 
-        audio = AudioSegment.from_file(file_path)
-        await send_log_to_user(bot, user_id, f"Audio caricato con successo. Durata: {len(audio)} ms")
+        if environment and profile_bytes and stored_profile is None:
+            await asyncio.to_thread(save_noise_profile, get_profile_store(), owner, environment,
+                                    NoiseProfile.from_bytes(profile_bytes))
+            logger.info(f"Profilo di rumore salvato per {owner}, ambiente '{environment}'.")
 
-        if len(audio) == 0:
-            await send_log_to_user(bot, user_id, "L'audio è vuoto.")
+        if result is None:
+            await progress.log("L'audio è vuoto.")
             return None
 
-        # Step 1: Normalizzazione del volume
-        if step == 'normalize':
-            normalized_audio = audio.normalize()
-            temp_norm_audio_path = os.path.join("tmp", f"{output_filename}_normalized.mp3")
-            normalized_audio.export(temp_norm_audio_path, format="mp3")
-            await send_audio_to_user(bot, user_id, temp_norm_audio_path, "Audio dopo la normalizzazione")
-            return temp_norm_audio_path
-
-        # Step 2: Riduzione del rumore
-        elif step == 'denoise':
-            y = np.array(audio.get_array_of_samples(), dtype=np.float32)
-            y /= np.max(np.abs(y))
-            y_denoised = nr.reduce_noise(y=y, sr=audio.frame_rate, prop_decrease=noise_factor)
-            temp_denoised_audio_path = os.path.join("tmp", f"{output_filename}_denoised.mp3")
-            denoised_audio = AudioSegment(y_denoised.tobytes(), frame_rate=audio.frame_rate, sample_width=2, channels=1)
-            denoised_audio.export(temp_denoised_audio_path, format="mp3")
-            await send_audio_to_user(bot, user_id, temp_denoised_audio_path, "Audio dopo la riduzione del rumore")
-            return temp_denoised_audio_path
-
-        # Step 3: Filtro high-pass
-        elif step == 'highpass':
-            y_denoised = np.array(audio.get_array_of_samples(), dtype=np.float32)
-            y_filtered_hp = butter_filter(y_denoised, low_cutoff, high_cutoff, audio.frame_rate, btype='high')
-            temp_hp_audio_path = os.path.join("tmp", f"{output_filename}_highpass.mp3")
-            hp_audio = AudioSegment(y_filtered_hp.tobytes(), frame_rate=audio.frame_rate, sample_width=2, channels=1)
-            hp_audio.export(temp_hp_audio_path, format="mp3")
-            await send_audio_to_user(bot, user_id, temp_hp_audio_path, "Audio dopo il filtro high-pass")
-            return temp_hp_audio_path
-
-        # Step 4: Filtro low-pass
-        elif step == 'lowpass':
-            y_filtered_hp = np.array(audio.get_array_of_samples(), dtype=np.float32)
-            y_filtered_lp = butter_filter(y_filtered_hp, low_cutoff, high_cutoff, audio.frame_rate, btype='low')
-            temp_lp_audio_path = os.path.join("tmp", f"{output_filename}_lowpass.mp3")
-            lp_audio = AudioSegment(y_filtered_lp.tobytes(), frame_rate=audio.frame_rate, sample_width=2, channels=1)
-            lp_audio.export(temp_lp_audio_path, format="mp3")
-            await send_audio_to_user(bot, user_id, temp_lp_audio_path, "Audio dopo il filtro low-pass")
-            return temp_lp_audio_path
-
-        # Step finale: restituzione del file pulito
-        else:
-            final_audio_path = os.path.join("tmp", f"{output_filename}_cleaned.mp3")
-            audio.export(final_audio_path, format="mp3")
-            await send_log_to_user(bot, user_id, "Pulizia dell'audio completata.")
-            return final_audio_path
-    
+        await progress.log("Pulizia dell'audio completata.")
+        return result
+
+    except JobQueueFullError:
+        await progress.log("Il server è al momento sovraccarico. Riprova tra qualche minuto.")
+        logger.warning(f"Pulizia rifiutata per {owner}: coda piena.")
+        return None
+    except JobTimeoutError:
+        await progress.log("La pulizia dell'audio ha richiesto troppo tempo ed è stata interrotta.")
+        logger.error(f"Timeout durante la pulizia dell'audio per {owner}.")
+        return None
     except Exception as e:
-        await send_log_to_user(bot, user_id, f"Errore durante la pulizia dell'audio: {e}")
+        await progress.log(f"Errore durante la pulizia dell'audio: {e}")
         logger.error(f"Errore durante la pulizia dell'audio: {e}")
         return None
@@ -0,0 +1,179 @@
+# audio/denoise.py
+
+import io
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft as sp_fft
+
+
+# Parametri STFT del gate spettrale
+STFT_SIZE = 2048
+STFT_HOP = STFT_SIZE // 4
+
+# Stima del profilo: frame più silenziosi nei primi secondi della registrazione
+PROFILE_ANALYSIS_SECONDS = 30.0
+PROFILE_QUIET_FRACTION = 0.2
+THRESHOLD_STD = 1.5
+# Numero di frame su cui viene mediata la maschera, per attenuare il "rumore musicale"
+MASK_SMOOTHING_FRAMES = 3
+
+# Finestra sqrt-hann in analisi e sintesi: con hop = n_fft / 4 la somma delle finestre vale 2
+STFT_WINDOW = np.sqrt(np.hanning(STFT_SIZE + 1)[:-1]).astype(np.float32)
+OLA_SCALE = np.float32(STFT_HOP / (STFT_SIZE / 2))
+
+
+class NoiseProfile:
+    """Soglia in dB per ciascun bin di frequenza, stimata sul rumore di fondo."""
+
+    def __init__(self, threshold_db, sample_rate, n_fft=STFT_SIZE):
+        self.threshold_db = np.asarray(threshold_db, dtype=np.float32)
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez(buffer, threshold_db=self.threshold_db, sample_rate=self.sample_rate, n_fft=self.n_fft)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        values = np.load(io.BytesIO(data))
+        return cls(values['threshold_db'], int(values['sample_rate']), int(values['n_fft']))
+
+
+#######################
+# STFT vettorizzata   #
+#######################
+
+# STFT di un batch di segnali (batch, campioni) -> (batch, frame, bin), con un'unica FFT
+def stft(signals):
+    n_fft, hop = STFT_SIZE, STFT_HOP
+    pad = n_fft - hop
+    length = signals.shape[-1]
+    n_frames = max(1, -(-(length + pad) // hop))
+    total = (n_frames - 1) * hop + n_fft
+    padded = np.zeros(signals.shape[:-1] + (total,), dtype=np.float32)
+    padded[..., pad:pad + length] = signals
+    frames = sliding_window_view(padded, n_fft, axis=-1)[..., ::hop, :]
+    # scipy.fft mantiene la precisione singola (complex64), a differenza di numpy.fft
+    return sp_fft.rfft(frames * STFT_WINDOW, axis=-1)
+
+
+# Ricostruzione overlap-add vettorizzata: con hop = n_fft / R i frame si sommano in R gruppi disgiunti
+def istft(spectrum, length):
+    n_fft, hop = STFT_SIZE, STFT_HOP
+    frames = sp_fft.irfft(spectrum, n=n_fft, axis=-1).astype(np.float32, copy=False) * (STFT_WINDOW * OLA_SCALE)
+    batch_shape = frames.shape[:-2]
+    n_frames = frames.shape[-2]
+    overlap = n_fft // hop
+    total = (n_frames - 1) * hop + n_fft
+    output = np.zeros(batch_shape + (total + n_fft,), dtype=np.float32)
+    for k in range(overlap):
+        group = frames[..., k::overlap, :]
+        start = k * hop
+        flat = group.reshape(batch_shape + (-1,))
+        output[..., start:start + flat.shape[-1]] += flat
+    pad = n_fft - hop
+    return output[..., pad:pad + length]
+
+
+def magnitude_db(spectrum):
+    return 20 * np.log10(np.abs(spectrum) + np.float32(1e-10))
+
+
+# Stima del profilo di rumore dai tratti silenziosi iniziali o da un campione di solo rumore
+def estimate_noise_profile(y, sample_rate, analysis_seconds=PROFILE_ANALYSIS_SECONDS,
+                           quiet_fraction=PROFILE_QUIET_FRACTION, threshold_std=THRESHOLD_STD):
+    """
+    `y` ha forma (campioni, canali) o (campioni,). Per un campione fornito
+    dall'utente contenente solo rumore si può usare `quiet_fraction=1.0`.
+    """
+    y = np.asarray(y, dtype=np.float32)
+    mono = y.mean(axis=1) if y.ndim == 2 else y
+    if analysis_seconds:
+        mono = mono[:int(analysis_seconds * sample_rate)]
+    return profile_from_magnitudes(magnitude_db(stft(mono[None, :]))[0], sample_rate, quiet_fraction, threshold_std)
+
+
+# Profilo dai frame (frame, bin) a energia più bassa di uno spettro già calcolato
+def profile_from_magnitudes(magnitudes_db, sample_rate, quiet_fraction=PROFILE_QUIET_FRACTION,
+                            threshold_std=THRESHOLD_STD):
+    energy = magnitudes_db.mean(axis=1)
+    count = max(1, int(len(energy) * quiet_fraction))
+    quiet = magnitudes_db[np.argsort(energy)[:count]]
+    return NoiseProfile(quiet.mean(axis=0) + threshold_std * quiet.std(axis=0), sample_rate)
+
+
+# Un profilo è riutilizzabile solo con la stessa frequenza di campionamento
+def usable_profile(profile, sample_rate):
+    return profile is not None and profile.sample_rate == sample_rate and profile.n_fft == STFT_SIZE
+
+
+# Maschera del gate: 1 sopra la soglia, (1 - prop_decrease) sotto, mediata nel tempo
+def gate_mask(magnitudes_db, threshold_db, prop_decrease, smoothing_frames=MASK_SMOOTHING_FRAMES):
+    mask = np.where(magnitudes_db > threshold_db, np.float32(1.0), np.float32(1.0 - prop_decrease))
+    if smoothing_frames > 1 and mask.shape[-2] > 1:
+        kernel = np.ones(smoothing_frames, dtype=np.float32) / smoothing_frames
+        pad = smoothing_frames // 2
+        padded = np.pad(mask, [(0, 0)] * (mask.ndim - 2) + [(pad, smoothing_frames - 1 - pad), (0, 0)], mode='edge')
+        mask = sliding_window_view(padded, smoothing_frames, axis=-2) @ kernel
+    return mask
+
+
+# Riduzione del rumore di un singolo segnale (campioni, canali)
+def spectral_gate(y, sample_rate, profile=None, prop_decrease=1.0):
+    return denoise_batch([y], sample_rate, [profile], prop_decrease)[0]
+
+
+# Riduzione del rumore di più segnali con un'unica STFT sul batch
+def denoise_batch(signals, sample_rate, profiles=None, prop_decrease=1.0):
+    """
+    Applica il gate spettrale a una lista di segnali (campioni, canali) con la
+    stessa frequenza di campionamento. I segnali vengono allineati con zero
+    padding e trasformati insieme; per ogni segnale senza profilo il profilo
+    viene stimato sui suoi tratti silenziosi iniziali.
+    """
+    if profiles is None:
+        profiles = [None] * len(signals)
+    profiles = [
+        profile if usable_profile(profile, sample_rate) else estimate_noise_profile(y, sample_rate)
+        for y, profile in zip(signals, profiles)
+    ]
+    lengths = [len(y) for y in signals]
+    channels = [y.shape[1] for y in signals]
+    max_length = max(lengths) if lengths else 0
+
+    # Ogni canale di ogni segnale diventa una riga del batch
+    rows = np.zeros((sum(channels), max_length), dtype=np.float32)
+    thresholds = []
+    row = 0
+    for y, profile in zip(signals, profiles):
+        rows[row:row + y.shape[1], :len(y)] = y.T
+        thresholds.extend([profile.threshold_db] * y.shape[1])
+        row += y.shape[1]
+
+    spectrum = stft(rows)
+    mask = gate_mask(magnitude_db(spectrum), np.stack(thresholds)[:, None, :], prop_decrease)
+    cleaned = istft(spectrum * mask, max_length)
+
+    outputs = []
+    row = 0
+    for length, count in zip(lengths, channels):
+        outputs.append(np.ascontiguousarray(cleaned[row:row + count, :length].T))
+        row += count
+    return outputs
+
+
+###########################
+# Profili per ambiente    #
+###########################
+
+# Recupera il profilo salvato per l'utente e l'ambiente (es. un'aula), se presente
+def load_noise_profile(store, user_id, environment):
+    stored = store.get(user_id, environment)
+    return None if stored is None else NoiseProfile.from_bytes(stored[0])
+
+
+# Salva il profilo nell'archivio dei profili (utils/profile_store.py), per le registrazioni successive
+def save_noise_profile(store, user_id, environment, profile, source='estimated'):
+    store.put(user_id, environment, profile.to_bytes(), source=source)
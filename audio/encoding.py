@@ -0,0 +1,115 @@
+# audio/encoding.py
+
+import os
+import shutil
+import subprocess
+from collections import namedtuple
+from audio.ffmpeg_io import ffmpeg_input, probe_codec, open_encoder, close_encoder
+
+# Formato di un file prodotto dal bot: codec, contenitore e parametri di codifica.
+# `sample_rate` e `channels` a None mantengono quelli della sorgente.
+OutputProfile = namedtuple(
+    'OutputProfile', ['name', 'codec', 'container', 'extension', 'bitrate_kbps', 'sample_rate', 'channels', 'options']
+)
+
+# Nome del codec riportato da ffprobe per ogni encoder di ffmpeg
+_PROBED_CODECS = {'libopus': 'opus', 'libmp3lame': 'mp3'}
+
+PROFILES = {
+    # Risposte vocali: Opus come i messaggi vocali di Telegram (inviati con send_voice)
+    'voice': OutputProfile('voice', 'libopus', 'ogg', '.ogg', 48, 48000, None, ('-application', 'voip')),
+    # Anteprime compatte, mono a basso bitrate
+    'preview': OutputProfile('preview', 'libopus', 'ogg', '.ogg', 16, 16000, 1, ('-application', 'voip')),
+    # File inviati alla trascrizione: mono 16 kHz, la frequenza usata dal modello
+    'transcription': OutputProfile('transcription', 'libopus', 'ogg', '.ogg', 32, 16000, 1, ()),
+    # Massima compatibilità con i lettori (più lento da codificare e più grande)
+    'mp3': OutputProfile('mp3', 'libmp3lame', 'mp3', '.mp3', 128, None, None, ()),
+}
+
+DEFAULT_PROFILE = os.getenv('OUTPUT_PROFILE', 'voice')
+
+
+# Restituisce il profilo dato il nome (o il profilo stesso)
+def get_profile(profile):
+    if isinstance(profile, OutputProfile):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError(f"Profilo di codifica sconosciuto: {profile}. Valori ammessi: {', '.join(sorted(PROFILES))}.")
+    return PROFILES[profile]
+
+
+def is_opus(profile):
+    return get_profile(profile).codec == 'libopus'
+
+
+# Opzioni di output di ffmpeg per il profilo
+def output_args(profile):
+    profile = get_profile(profile)
+    args = ["-c:a", profile.codec, "-b:a", f"{profile.bitrate_kbps}k"]
+    if profile.sample_rate:
+        args += ["-ar", str(profile.sample_rate)]
+    if profile.channels:
+        args += ["-ac", str(profile.channels)]
+    return args + list(profile.options) + ["-f", profile.container]
+
+
+# Verifica se la sorgente è già nel formato del profilo (nessuna ricodifica necessaria)
+def matches_profile(source, profile):
+    profile = get_profile(profile)
+    info = probe_codec(source)
+    if info['codec'] != _PROBED_CODECS.get(profile.codec, profile.codec):
+        return False
+    if profile.container not in (info['container'] or '').split(','):
+        return False
+    if profile.channels and info['channels'] > profile.channels:
+        return False
+    # Un bitrate molto più alto di quello del profilo va comunque ridotto
+    if info['bit_rate'] and info['bit_rate'] > profile.bitrate_kbps * 1000 * 1.5:
+        return False
+    return True
+
+
+# Codifica il buffer float32 (campioni, canali) inviandolo direttamente a ffmpeg
+def encode_pcm(y, sample_rate, output_path, profile=DEFAULT_PROFILE):
+    import numpy as np
+
+    encoder = open_encoder(output_path, sample_rate, y.shape[1], output_args(profile))
+    try:
+        encoder.stdin.write(np.clip(y, -1.0, 1.0).astype(np.float32, copy=False).tobytes())
+    finally:
+        close_encoder(encoder)
+    return output_path
+
+
+# Converte la sorgente nel formato del profilo senza decodificarla in memoria
+def transcode(source, profile=DEFAULT_PROFILE, output_path=None):
+    """
+    Una sola invocazione di ffmpeg, da file o byte in ingresso. Con
+    `output_path` scrive il file e ne restituisce il percorso, altrimenti
+    restituisce i byte codificati.
+    """
+    input_arg, stdin_data = ffmpeg_input(source)
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-i", input_arg, "-vn"] + output_args(profile) + [output_path or "-"],
+        input=stdin_data, capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Errore di ffmpeg durante la conversione: {result.stderr.decode(errors='replace').strip()}")
+    return output_path if output_path else result.stdout
+
+
+# Porta la sorgente nel formato del profilo, ricodificando solo se necessario
+def encode_source(source, output_path, profile=DEFAULT_PROFILE):
+    """
+    Usata quando nessuno step ha modificato l'audio: se la sorgente è già nel
+    formato richiesto viene copiata così com'è, altrimenti convertita.
+    Restituisce (percorso di output, True se è stata ricodificata).
+    """
+    if matches_profile(source, profile):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            with open(output_path, 'wb') as f:
+                f.write(source)
+        else:
+            shutil.copyfile(source, output_path)
+        return output_path, False
+    return transcode(source, profile, output_path), True
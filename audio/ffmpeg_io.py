@@ -0,0 +1,191 @@
+# audio/ffmpeg_io.py
+
+import json
+import subprocess
+import tempfile
+import threading
+
+# Estensioni dei file audio riconosciuti (decodificati da ffmpeg)
+AUDIO_EXTENSIONS = {'.mp3', '.ogg', '.oga', '.opus', '.wav', '.m4a', '.flac', '.aac', '.webm', '.mp4'}
+
+# Argomento di input per ffmpeg/ffprobe: un percorso oppure byte inviati su stdin
+def ffmpeg_input(source):
+    """
+    Restituisce la coppia (argomento `-i`, byte da scrivere su stdin).
+    Le sorgenti in memoria (bytes/bytearray) vengono lette da `pipe:0`.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return "pipe:0", bytes(source)
+    return str(source), None
+
+
+# Descrizione leggibile di una sorgente audio, per i log
+def describe_source(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return f"<{len(source)} byte in memoria>"
+    return str(source)
+
+
+# Durata riportata da ffprobe: None se mancante o "N/A"
+def _parse_duration(value):
+    try:
+        duration = float(value)
+    except (TypeError, ValueError):
+        return None
+    return duration if duration > 0 else None
+
+
+def _run_probe(input_arg, stdin_data):
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error", "-select_streams", "a:0",
+            "-show_entries", "stream=sample_rate,channels,duration:format=duration",
+            "-of", "json", input_arg,
+        ],
+        input=stdin_data, capture_output=True, check=True,
+    )
+    info = json.loads(result.stdout)
+    stream = info['streams'][0]
+    duration = _parse_duration(info.get('format', {}).get('duration')) or _parse_duration(stream.get('duration'))
+    return int(stream['sample_rate']), int(stream['channels']), duration
+
+
+# Legge frequenza di campionamento, canali e durata tramite ffprobe
+def probe_audio(source):
+    """
+    Restituisce (frame_rate, canali, durata in secondi) del primo stream audio.
+    Da stdin ffprobe non può cercare la fine del file e spesso non conosce la
+    durata (es. Ogg/Opus): in quel caso i byte vengono scritti in un file
+    temporaneo e analizzati da lì. Durata 0.0 se resta comunque sconosciuta.
+    """
+    input_arg, stdin_data = ffmpeg_input(source)
+    sample_rate, channels, duration = _run_probe(input_arg, stdin_data)
+    if duration is None and stdin_data is not None:
+        with tempfile.NamedTemporaryFile(suffix=".audio") as spill:
+            spill.write(stdin_data)
+            spill.flush()
+            _, _, duration = _run_probe(spill.name, None)
+    return sample_rate, channels, duration or 0.0
+
+
+# Legge codec, contenitore, canali e bitrate del primo stream audio tramite ffprobe
+def probe_codec(source):
+    """
+    Restituisce un dizionario con 'codec' (es. 'opus'), 'container' (es. 'ogg'),
+    'channels' e 'bit_rate' (in bit/s, None se non disponibile).
+    """
+    input_arg, stdin_data = ffmpeg_input(source)
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error", "-select_streams", "a:0",
+            "-show_entries", "stream=codec_name,channels,bit_rate:format=format_name,bit_rate",
+            "-of", "json", input_arg,
+        ],
+        input=stdin_data, capture_output=True, check=True,
+    )
+    info = json.loads(result.stdout)
+    stream = info['streams'][0]
+    container = info.get('format', {})
+    bit_rate = stream.get('bit_rate') or container.get('bit_rate')
+    return {
+        'codec': stream.get('codec_name'),
+        'container': container.get('format_name'),
+        'channels': int(stream.get('channels') or 0),
+        'bit_rate': int(bit_rate) if bit_rate and str(bit_rate).isdigit() else None,
+    }
+
+
+def _pcm_command(input_arg, sample_rate, channels):
+    return [
+        "ffmpeg", "-v", "error", "-i", input_arg,
+        "-f", "f32le", "-acodec", "pcm_f32le",
+        "-ar", str(sample_rate), "-ac", str(channels), "-",
+    ]
+
+
+# Scrive i byte su stdin del processo in un thread separato, per non bloccare la lettura di stdout
+def _feed_stdin(process, data):
+    def write():
+        try:
+            process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except (BrokenPipeError, ValueError):
+                pass
+
+    thread = threading.Thread(target=write, daemon=True)
+    thread.start()
+    return thread
+
+
+# Decodifica completa in un unico buffer float32 (campioni, canali)
+def decode_pcm(source, sample_rate, channels):
+    # numpy serve solo nei worker: il modulo resta leggero da importare nel processo del bot
+    import numpy as np
+
+    input_arg, stdin_data = ffmpeg_input(source)
+    result = subprocess.run(_pcm_command(input_arg, sample_rate, channels), input=stdin_data, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Errore di ffmpeg durante la decodifica: {result.stderr.decode(errors='replace').strip()}")
+    usable = len(result.stdout) - len(result.stdout) % (channels * 4)
+    return np.frombuffer(result.stdout[:usable], dtype=np.float32).reshape(-1, channels)
+
+
+# Decodifica in streaming: restituisce blocchi float32 (campioni, canali)
+def iter_pcm_blocks(source, sample_rate, channels, block_frames):
+    """
+    Legge il PCM float32 da ffmpeg a blocchi di dimensione fissa, senza mai
+    caricare l'intero file decodificato in memoria.
+    """
+    import numpy as np
+
+    input_arg, stdin_data = ffmpeg_input(source)
+    process = subprocess.Popen(
+        _pcm_command(input_arg, sample_rate, channels),
+        stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    if stdin_data is not None:
+        _feed_stdin(process, stdin_data)
+    block_bytes = block_frames * channels * 4
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % (channels * 4)
+            yield np.frombuffer(data[:usable], dtype=np.float32).reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode(errors='replace')
+        process.stderr.close()
+        if process.wait() != 0 and stderr:
+            raise RuntimeError(f"Errore di ffmpeg durante la decodifica: {stderr.strip()}")
+
+
+# Avvia un encoder ffmpeg che riceve PCM float32 su stdin
+def open_encoder(output_path, sample_rate, channels, output_args=("-f", "mp3")):
+    """
+    `output_args` sono le opzioni di codifica di ffmpeg (codec, bitrate,
+    formato), di solito prese da un profilo di `audio.encoding`.
+    """
+    return subprocess.Popen(
+        [
+            "ffmpeg", "-v", "error", "-y",
+            "-f", "f32le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "-",
+            *output_args, output_path,
+        ],
+        stdin=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+
+# Chiude l'encoder e verifica che la codifica sia andata a buon fine
+def close_encoder(process):
+    process.stdin.close()
+    stderr = process.stderr.read().decode(errors='replace')
+    process.stderr.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"Errore di ffmpeg durante la codifica: {stderr.strip()}")
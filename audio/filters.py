@@ -0,0 +1,55 @@
+# audio/filters.py
+
+from functools import lru_cache
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfiltfilt
+
+DEFAULT_ORDER = 4
+
+# Alias accettati da scipy per il tipo di filtro, ricondotti a un'unica forma
+_BTYPES = {
+    'low': 'lowpass', 'lowpass': 'lowpass',
+    'high': 'highpass', 'highpass': 'highpass',
+    'band': 'bandpass', 'bandpass': 'bandpass',
+    'bandstop': 'bandstop', 'stop': 'bandstop',
+}
+
+
+# Normalizza frequenze di taglio e tipo di filtro, così che la chiave della cache sia univoca
+def _normalize(cutoff, btype):
+    try:
+        btype = _BTYPES[btype]
+    except KeyError:
+        raise ValueError(f"Tipo di filtro non supportato: {btype}")
+    cutoffs = tuple(float(c) for c in np.atleast_1d(cutoff))
+    expected = 2 if btype in ('bandpass', 'bandstop') else 1
+    if len(cutoffs) != expected:
+        raise ValueError(f"Il filtro {btype} richiede {expected} frequenze di taglio, ricevute {len(cutoffs)}.")
+    return cutoffs, btype
+
+
+@lru_cache(maxsize=128)
+def _design(order, cutoffs, sample_rate, btype):
+    nyq = 0.5 * sample_rate
+    if any(c <= 0 or c >= nyq for c in cutoffs):
+        raise ValueError(f"Frequenze di taglio {cutoffs} fuori dall'intervallo (0, {nyq}) Hz.")
+    normalized = cutoffs[0] / nyq if len(cutoffs) == 1 else [c / nyq for c in cutoffs]
+    return butter(order, normalized, btype=btype, output='sos')
+
+
+# Coefficienti SOS di un filtro Butterworth, memorizzati per (ordine, tagli, frequenza, tipo)
+def design_sos(cutoff, sample_rate, btype, order=DEFAULT_ORDER):
+    cutoffs, btype = _normalize(cutoff, btype)
+    return _design(int(order), cutoffs, int(sample_rate), btype)
+
+
+# Applica il filtro lungo l'asse dei campioni: tutti i canali in un'unica chiamata vettorizzata
+def apply_filter(y, cutoff, sample_rate, btype, order=DEFAULT_ORDER, zero_phase=True, axis=0):
+    """
+    Filtra `y` (ad es. (campioni, canali)) con un Butterworth in forma SOS.
+    Con `zero_phase` usa `sosfiltfilt` (nessuno sfasamento), altrimenti `sosfilt`.
+    """
+    sos = design_sos(cutoff, sample_rate, btype, order)
+    y = np.asarray(y, dtype=np.float32)
+    filtered = sosfiltfilt(sos, y, axis=axis) if zero_phase else sosfilt(sos, y, axis=axis)
+    return filtered.astype(np.float32, copy=False)
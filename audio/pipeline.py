@@ -0,0 +1,119 @@
+# audio/pipeline.py
+
+import numpy as np
+
+from audio.denoise import spectral_gate
+from audio.filters import apply_filter
+from audio.ffmpeg_io import probe_audio, decode_pcm
+from audio.encoding import DEFAULT_PROFILE, encode_pcm
+
+# Parametri di default della pipeline di pulizia
+DEFAULT_PARAMS = {
+    'noise_factor': 0.2,
+    'low_cutoff': 300.0,
+    'high_cutoff': 3000.0,
+    'headroom_db': 0.1,
+}
+
+# Sequenza di default: normalizzazione -> riduzione rumore -> high-pass -> low-pass
+DEFAULT_STEPS = ('normalize', 'denoise', 'highpass', 'lowpass')
+
+# Descrizioni dei singoli step, usate per i log verso l'utente
+STEP_DESCRIPTIONS = {
+    'normalize': "normalizzazione del volume",
+    'denoise': "riduzione del rumore",
+    'highpass': "filtro high-pass",
+    'lowpass': "filtro low-pass",
+}
+
+
+# Decodifica il file una sola volta in un buffer float32 (campioni x canali)
+def decode_audio(source):
+    """
+    Decodifica un file audio (percorso o byte in memoria, passati a ffmpeg su
+    stdin) in un array float32 di forma (campioni, canali) con valori in [-1, 1].
+    Restituisce la coppia (campioni, frame_rate).
+    """
+    sample_rate, channels, _ = probe_audio(source)
+    return decode_pcm(source, sample_rate, channels), sample_rate
+
+
+# Codifica il buffer float32 in un file audio (una sola codifica a fine pipeline)
+def encode_audio(y, sample_rate, output_path, profile=DEFAULT_PROFILE):
+    """
+    Invia il buffer float32 direttamente a ffmpeg e lo codifica secondo il
+    profilo richiesto (vedi `audio.encoding.PROFILES`).
+    """
+    return encode_pcm(y, sample_rate, output_path, profile)
+
+
+#######################
+# Step della pipeline #
+#######################
+
+def normalize_stage(y, sample_rate, params):
+    peak = np.max(np.abs(y)) if y.size else 0.0
+    if peak == 0:
+        return y
+    target = 10 ** (-params['headroom_db'] / 20)
+    return y * np.float32(target / peak)
+
+
+def denoise_stage(y, sample_rate, params):
+    # Gate spettrale con profilo di rumore precalcolato (se presente) o stimato sui silenzi iniziali
+    return spectral_gate(y, sample_rate, params.get('noise_profile'), params['noise_factor'])
+
+
+def highpass_stage(y, sample_rate, params):
+    return apply_filter(y, params['low_cutoff'], sample_rate, btype='high')
+
+
+def lowpass_stage(y, sample_rate, params):
+    return apply_filter(y, params['high_cutoff'], sample_rate, btype='low')
+
+
+STAGES = {
+    'normalize': normalize_stage,
+    'denoise': denoise_stage,
+    'highpass': highpass_stage,
+    'lowpass': lowpass_stage,
+}
+
+
+# Risolve i parametri della pipeline partendo da quelli di default
+def resolve_params(params=None):
+    resolved = dict(DEFAULT_PARAMS)
+    if params:
+        resolved.update(params)
+    return resolved
+
+
+# Verifica che tutti gli step richiesti esistano
+def validate_steps(steps):
+    unknown = [step for step in steps if step not in STAGES]
+    if unknown:
+        raise ValueError(f"Step della pipeline sconosciuti: {', '.join(unknown)}")
+    return tuple(steps)
+
+
+# Applica un singolo step al buffer in memoria
+def apply_stage(step, y, sample_rate, params=None):
+    return STAGES[step](y, sample_rate, resolve_params(params))
+
+
+# Esegue in memoria tutti gli step richiesti, nell'ordine indicato
+def run_pipeline(y, sample_rate, steps=DEFAULT_STEPS, params=None):
+    params = resolve_params(params)
+    for step in validate_steps(steps):
+        y = STAGES[step](y, sample_rate, params)
+    return y
+
+
+# Decodifica una volta, applica la pipeline e codifica una volta
+def process_file(source, output_path, steps=DEFAULT_STEPS, params=None, profile=DEFAULT_PROFILE):
+    """
+    Pulisce un file audio con un'unica decodifica e un'unica codifica finale.
+    """
+    y, sample_rate = decode_audio(source)
+    y = run_pipeline(y, sample_rate, steps, params)
+    return encode_audio(y, sample_rate, output_path, profile)
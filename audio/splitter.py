@@ -0,0 +1,104 @@
+# audio/splitter.py
+
+import subprocess
+from collections import namedtuple
+
+from audio.ffmpeg_io import ffmpeg_input, iter_pcm_blocks
+from audio.encoding import PROFILES, output_args
+
+# Il PCM per l'analisi dei silenzi è mono a 16 kHz, come quello usato da Whisper
+ANALYSIS_SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+SMOOTHING_SECONDS = 0.3
+
+# Limite dell'API Whisper (25 MB) con un margine di sicurezza
+MAX_UPLOAD_BYTES = 24 * 1024 * 1024
+# Codifica dei chunk: Opus mono 16 kHz, compatta e accettata da Whisper
+CHUNK_BITRATE_KBPS = PROFILES['transcription'].bitrate_kbps
+DEFAULT_MAX_CHUNK_SECONDS = 10 * 60
+DEFAULT_MIN_CHUNK_SECONDS = 60
+
+AudioChunk = namedtuple('AudioChunk', ['index', 'start', 'end'])
+
+
+# Durata massima di un chunk affinché la codifica resti sotto il limite di upload
+def max_seconds_for_upload(max_bytes=MAX_UPLOAD_BYTES, bitrate_kbps=CHUNK_BITRATE_KBPS):
+    return 0.9 * max_bytes * 8 / (bitrate_kbps * 1000)
+
+
+# Energia in dB per frame, calcolata in streaming sul PCM decodificato
+def compute_frame_energy(source, frame_seconds=FRAME_SECONDS, block_seconds=60.0):
+    # L'analisi gira nei worker: numpy non viene caricato nel processo del bot
+    import numpy as np
+
+    frame = int(ANALYSIS_SAMPLE_RATE * frame_seconds)
+    block_frames = int(ANALYSIS_SAMPLE_RATE * block_seconds)
+    energies = []
+    remainder = np.zeros(0, dtype=np.float32)
+    for block in iter_pcm_blocks(source, ANALYSIS_SAMPLE_RATE, 1, block_frames):
+        samples = np.concatenate([remainder, block[:, 0]])
+        usable = len(samples) - len(samples) % frame
+        frames = samples[:usable].reshape(-1, frame)
+        energies.append(10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12))
+        remainder = samples[usable:]
+    if not energies:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(energies)
+
+
+# Sceglie i punti di taglio nei tratti più silenziosi vicino alla durata massima
+def find_split_points(energy_db, frame_seconds=FRAME_SECONDS, max_chunk_seconds=DEFAULT_MAX_CHUNK_SECONDS,
+                      min_chunk_seconds=DEFAULT_MIN_CHUNK_SECONDS):
+    """
+    Restituisce gli istanti di taglio (in secondi). Ogni chunk dura al massimo
+    `max_chunk_seconds`; il taglio cade nel punto di energia minima (media mobile)
+    nella seconda metà della finestra disponibile, tipicamente una pausa del parlato.
+    """
+    import numpy as np
+
+    total_frames = len(energy_db)
+    max_frames = int(max_chunk_seconds / frame_seconds)
+    min_frames = min(int(min_chunk_seconds / frame_seconds), max_frames // 2)
+    if total_frames <= max_frames:
+        return []
+
+    width = max(1, int(SMOOTHING_SECONDS / frame_seconds))
+    smoothed = np.convolve(energy_db, np.ones(width) / width, mode='same')
+
+    points = []
+    start = 0
+    while total_frames - start > max_frames:
+        window_start = start + max(min_frames, max_frames // 2)
+        window_end = start + max_frames
+        cut = window_start + int(np.argmin(smoothed[window_start:window_end]))
+        points.append(cut * frame_seconds)
+        start = cut
+    return points
+
+
+# Suddivide il file in chunk delimitati da silenzi e di dimensione limitata
+def split_audio(source, duration, max_chunk_seconds=DEFAULT_MAX_CHUNK_SECONDS,
+                min_chunk_seconds=DEFAULT_MIN_CHUNK_SECONDS):
+    max_chunk_seconds = min(max_chunk_seconds, max_seconds_for_upload())
+    if duration <= max_chunk_seconds:
+        return [AudioChunk(0, 0.0, duration)]
+    energy_db = compute_frame_energy(source)
+    bounds = [0.0] + find_split_points(energy_db, FRAME_SECONDS, max_chunk_seconds, min_chunk_seconds) + [duration]
+    return [AudioChunk(i, start, end) for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+
+# Codifica un singolo chunk (profilo 'transcription': Opus mono 16 kHz) e ne restituisce i byte
+def export_chunk(source, chunk, bitrate_kbps=CHUNK_BITRATE_KBPS):
+    input_arg, stdin_data = ffmpeg_input(source)
+    seek = ["-ss", f"{chunk.start:.3f}", "-t", f"{chunk.end - chunk.start:.3f}"]
+    # Su stdin non si può fare seek: il taglio avviene lato output
+    input_args = ["-i", input_arg] + seek if stdin_data is not None else seek + ["-i", input_arg]
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error"] + input_args
+        + output_args(PROFILES['transcription']._replace(bitrate_kbps=bitrate_kbps)) + ["-"],
+        input=stdin_data, capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Errore di ffmpeg durante l'esportazione del chunk {chunk.index}: "
+                           f"{result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
@@ -0,0 +1,215 @@
+# audio/streaming.py
+
+import contextlib
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft as sp_fft
+from scipy.signal import sosfilt
+
+from audio.filters import design_sos
+from audio.ffmpeg_io import probe_audio, iter_pcm_blocks, open_encoder, close_encoder
+from audio.encoding import DEFAULT_PROFILE, output_args
+from audio.denoise import (
+    STFT_SIZE,
+    STFT_HOP,
+    STFT_WINDOW,
+    OLA_SCALE,
+    magnitude_db,
+    profile_from_magnitudes,
+    usable_profile,
+    gate_mask,
+)
+from audio.pipeline import resolve_params, validate_steps
+
+# Durata di default di un blocco PCM letto da ffmpeg
+DEFAULT_BLOCK_SECONDS = 10.0
+
+
+#########################
+# Processori a blocchi  #
+#########################
+
+class GainProcessor:
+    """Applica un guadagno costante (usato per la normalizzazione a due passate)."""
+
+    def __init__(self, gain):
+        self.gain = np.float32(gain)
+
+    def process(self, block):
+        return block * self.gain
+
+    def flush(self):
+        return None
+
+
+class StreamingIIRFilter:
+    """Filtro Butterworth causale con stato `zi` mantenuto tra un blocco e l'altro."""
+
+    def __init__(self, cutoff, sample_rate, channels, btype, order=4):
+        self.sos = design_sos(cutoff, sample_rate, btype, order)
+        self.zi = np.zeros((self.sos.shape[0], 2, channels))
+
+    def process(self, block):
+        filtered, self.zi = sosfilt(self.sos, block, axis=0, zi=self.zi)
+        return filtered.astype(np.float32)
+
+    def flush(self):
+        return None
+
+
+class StreamingSpectralGate:
+    """
+    Riduzione del rumore a blocchi con STFT e overlap-add. Se non viene fornito
+    un profilo, il rumore viene stimato sui frame più silenziosi del primo
+    blocco e poi riutilizzato (disponibile in `profile` a fine elaborazione).
+    """
+
+    def __init__(self, channels, sample_rate, prop_decrease, profile=None):
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.prop_decrease = prop_decrease
+        self.profile = profile if usable_profile(profile, sample_rate) else None
+        self.n_fft = STFT_SIZE
+        self.hop = STFT_HOP
+        # Il buffer d'ingresso è pre-caricato di zeri: i primi campioni in uscita vanno scartati
+        self._input = np.zeros((channels, self.n_fft - self.hop), dtype=np.float32)
+        self._tail = np.zeros((channels, self.n_fft - self.hop), dtype=np.float32)
+        self._to_drop = self.n_fft - self.hop
+        self._consumed = 0
+        self._emitted = 0
+
+    def _run(self, block):
+        self._input = np.concatenate([self._input, block.T], axis=1)
+        n_frames = (self._input.shape[1] - self.n_fft) // self.hop + 1
+        if n_frames <= 0:
+            return np.zeros((0, self.channels), dtype=np.float32)
+
+        # Tutti i frame disponibili vengono trasformati con un'unica FFT vettorizzata
+        usable = (n_frames - 1) * self.hop + self.n_fft
+        frames = sliding_window_view(self._input[:, :usable], self.n_fft, axis=1)[:, ::self.hop]
+        spectrum = sp_fft.rfft(frames * STFT_WINDOW, axis=-1)
+        magnitudes = magnitude_db(spectrum)
+        if self.profile is None:
+            self.profile = profile_from_magnitudes(magnitudes.mean(axis=0), self.sample_rate)
+        mask = gate_mask(magnitudes, self.profile.threshold_db, self.prop_decrease)
+        frames = sp_fft.irfft(spectrum * mask, n=self.n_fft, axis=-1).astype(np.float32, copy=False)
+        frames *= STFT_WINDOW * OLA_SCALE
+
+        # Overlap-add con la coda del blocco precedente
+        output = np.zeros((self.channels, usable), dtype=np.float32)
+        output[:, :self._tail.shape[1]] += self._tail
+        for i in range(n_frames):
+            start = i * self.hop
+            output[:, start:start + self.n_fft] += frames[:, i]
+
+        ready = n_frames * self.hop
+        self._tail = output[:, ready:]
+        self._input = self._input[:, ready:]
+        return output[:, :ready].T
+
+    def _trim(self, output):
+        if self._to_drop:
+            dropped = min(self._to_drop, len(output))
+            output = output[dropped:]
+            self._to_drop -= dropped
+        output = output[:self._consumed - self._emitted]
+        self._emitted += len(output)
+        return output
+
+    def process(self, block):
+        self._consumed += len(block)
+        return self._trim(self._run(block))
+
+    def flush(self):
+        output = self._run(np.zeros((self.n_fft, self.channels), dtype=np.float32))
+        return self._trim(np.concatenate([output, self._tail.T]))
+
+
+# Scansione preliminare per il picco, necessaria alla normalizzazione in streaming
+def scan_peak(source, sample_rate, channels, block_frames):
+    peak = 0.0
+    for block in iter_pcm_blocks(source, sample_rate, channels, block_frames):
+        if block.size:
+            peak = max(peak, float(np.max(np.abs(block))))
+    return peak
+
+
+# Costruisce la catena di processori a blocchi corrispondente agli step richiesti
+def build_processors(source, steps, params, sample_rate, channels, block_frames, timer=None):
+    processors = []
+    for step in steps:
+        if step == 'normalize':
+            with timer.stage('scan') if timer is not None else contextlib.nullcontext():
+                peak = scan_peak(source, sample_rate, channels, block_frames)
+            target = 10 ** (-params['headroom_db'] / 20)
+            processors.append(GainProcessor(target / peak if peak > 0 else 1.0))
+        elif step == 'denoise':
+            processors.append(StreamingSpectralGate(channels, sample_rate, params['noise_factor'],
+                                                    profile=params.get('noise_profile')))
+        elif step == 'highpass':
+            processors.append(StreamingIIRFilter(params['low_cutoff'], sample_rate, channels, 'high'))
+        elif step == 'lowpass':
+            processors.append(StreamingIIRFilter(params['high_cutoff'], sample_rate, channels, 'low'))
+    return processors
+
+
+# Fa passare un blocco attraverso la catena a partire dal processore `start`
+def _run_chain(processors, block, start=0, timer=None, steps=None):
+    for i in range(start, len(processors)):
+        if block is None or len(block) == 0:
+            return None
+        if timer is None:
+            block = processors[i].process(block)
+        else:
+            with timer.stage(steps[i]):
+                block = processors[i].process(block)
+    return block
+
+
+# Blocchi PCM da ffmpeg, con il tempo di attesa della decodifica conteggiato nel timer
+def _timed_blocks(blocks, timer):
+    iterator = iter(blocks)
+    while True:
+        with timer.stage('decode') if timer is not None else contextlib.nullcontext():
+            block = next(iterator, None)
+        if block is None:
+            return
+        yield block
+
+
+# Pulisce un file a blocchi: memoria di picco costante, indipendente dalla durata
+def stream_process_file(source, output_path, steps, params=None, profile=DEFAULT_PROFILE,
+                        block_seconds=DEFAULT_BLOCK_SECONDS, timer=None):
+    """
+    Versione in streaming di `audio.pipeline.process_file`: ffmpeg decodifica a
+    blocchi, ogni step mantiene il proprio stato tra i blocchi e l'uscita viene
+    inviata direttamente all'encoder. `source` è un percorso o i byte del file.
+    Restituisce (percorso di output, profilo di rumore usato dal denoise o None).
+    Con un `StageTimer` viene misurato il tempo speso in ogni step.
+    """
+    steps = validate_steps(steps)
+    params = resolve_params(params)
+    sample_rate, channels, _ = probe_audio(source)
+    block_frames = int(sample_rate * block_seconds)
+    processors = build_processors(source, steps, params, sample_rate, channels, block_frames, timer=timer)
+
+    encoder = open_encoder(output_path, sample_rate, channels, output_args(profile))
+
+    def write(output):
+        if output is not None and len(output):
+            with timer.stage('encode') if timer is not None else contextlib.nullcontext():
+                encoder.stdin.write(np.clip(output, -1.0, 1.0).astype(np.float32, copy=False).tobytes())
+
+    try:
+        for block in _timed_blocks(iter_pcm_blocks(source, sample_rate, channels, block_frames), timer):
+            write(_run_chain(processors, block, timer=timer, steps=steps))
+
+        # Svuota i buffer interni, propagando le code nei processori successivi
+        for i, processor in enumerate(processors):
+            write(_run_chain(processors, processor.flush(), start=i + 1, timer=timer, steps=steps))
+    finally:
+        with timer.stage('encode') if timer is not None else contextlib.nullcontext():
+            close_encoder(encoder)
+
+    gates = [p for p in processors if isinstance(p, StreamingSpectralGate)]
+    return output_path, gates[0].profile if gates else None
@@ -0,0 +1,74 @@
+# benchmarks/bench_denoise.py
+#
+# Confronta il gate spettrale interno (audio.denoise) con noisereduce.reduce_noise,
+# la chiamata usata in precedenza dallo step di denoise.
+#
+# Uso: python -m benchmarks.bench_denoise [--seconds 60] [--sample-rate 16000] [--repeat 3]
+
+import argparse
+import time
+import numpy as np
+
+from audio.denoise import spectral_gate, denoise_batch, estimate_noise_profile
+from benchmarks.fixtures import synthesize
+
+NOISE_FACTOR = 0.2
+
+
+# Rapporto segnale/rumore (dB) rispetto al segnale pulito di riferimento
+def snr_db(reference, estimate):
+    error = reference - estimate
+    return 10 * np.log10(np.sum(reference ** 2) / (np.sum(error ** 2) + 1e-12))
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del denoise: gate spettrale interno vs noisereduce.")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=4, help="Numero di file nel test batch")
+    args = parser.parse_args()
+
+    clean, noisy = synthesize(args.seconds, args.sample_rate)
+    print(f"Segnale: {args.seconds:.0f} s a {args.sample_rate} Hz, SNR in ingresso {snr_db(clean, noisy):.2f} dB")
+
+    results = {}
+    try:
+        import noisereduce as nr
+        elapsed, output = best_time(
+            lambda: nr.reduce_noise(y=noisy[:, 0], sr=args.sample_rate, prop_decrease=NOISE_FACTOR), args.repeat
+        )
+        results['noisereduce'] = (elapsed, snr_db(clean[:, 0], output))
+    except ImportError:
+        print("noisereduce non installato: confronto non disponibile.")
+
+    elapsed, output = best_time(lambda: spectral_gate(noisy, args.sample_rate, None, NOISE_FACTOR), args.repeat)
+    results['gate (stima profilo)'] = (elapsed, snr_db(clean, output))
+
+    profile = estimate_noise_profile(noisy, args.sample_rate)
+    elapsed, output = best_time(lambda: spectral_gate(noisy, args.sample_rate, profile, NOISE_FACTOR), args.repeat)
+    results['gate (profilo in cache)'] = (elapsed, snr_db(clean, output))
+
+    signals = [synthesize(args.seconds, args.sample_rate, seed=i)[1] for i in range(args.batch)]
+    elapsed, _ = best_time(lambda: denoise_batch(signals, args.sample_rate, [profile] * args.batch, NOISE_FACTOR), args.repeat)
+    results[f'gate batch x{args.batch} (per file)'] = (elapsed / args.batch, None)
+
+    baseline = results.get('noisereduce', (None,))[0]
+    print(f"{'metodo':<30}{'tempo (s)':>12}{'SNR (dB)':>12}{'speedup':>10}")
+    for name, (elapsed, snr) in results.items():
+        speedup = f"{baseline / elapsed:.1f}x" if baseline else "-"
+        snr_text = f"{snr:.2f}" if snr is not None else "-"
+        print(f"{name:<30}{elapsed:>12.3f}{snr_text:>12}{speedup:>10}")
+
+
+if __name__ == '__main__':
+    main()
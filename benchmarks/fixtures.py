@@ -0,0 +1,58 @@
+# benchmarks/fixtures.py
+#
+# Fixture audio sintetiche e riproducibili per i benchmark: "parlato" (armoniche
+# modulate, con pause) su rumore rosa, con 2 s iniziali di solo rumore.
+
+import os
+import wave
+import numpy as np
+
+DEFAULT_FIXTURE_DIR = os.path.join("benchmarks", ".fixtures")
+
+
+# Restituisce (segnale pulito, segnale rumoroso) di forma (campioni, canali)
+def synthesize(seconds, sample_rate, channels=1, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    envelope = (np.sin(2 * np.pi * 0.7 * t) > 0).astype(np.float32) * (t > 2.0)
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    speech = (sum(np.sin(k * phase) / k for k in range(1, 8)) * envelope * 0.2).astype(np.float32)
+
+    clean = np.repeat(speech[:, None], channels, axis=1)
+    noisy = np.empty_like(clean)
+    shaping = 1 / np.sqrt(np.arange(1, len(t) // 2 + 2))
+    for channel in range(channels):
+        # Rumore diverso per ogni canale, come con microfoni distinti
+        pink = np.fft.irfft(np.fft.rfft(rng.standard_normal(len(t))) * shaping, n=len(t))
+        noisy[:, channel] = speech + pink / np.max(np.abs(pink)) * 0.05
+    return clean, noisy
+
+
+# Scrive un WAV PCM a 16 bit (non serve ffmpeg per generare le fixture)
+def write_wav(path, y, sample_rate):
+    pcm = (np.clip(y, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(y.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+# Legge un WAV PCM a 16 bit in float32 (campioni, canali)
+def read_wav(path):
+    with wave.open(path, 'rb') as f:
+        channels, sample_rate = f.getnchannels(), f.getframerate()
+        data = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+    return (data.reshape(-1, channels).astype(np.float32) / 32768), sample_rate
+
+
+# Percorso della fixture richiesta, generata alla prima richiesta
+def fixture_path(seconds, sample_rate, channels, fixture_dir=DEFAULT_FIXTURE_DIR):
+    os.makedirs(fixture_dir, exist_ok=True)
+    path = os.path.join(fixture_dir, f"speech_{seconds:g}s_{sample_rate}hz_{channels}ch.wav")
+    if not os.path.exists(path):
+        _, noisy = synthesize(seconds, sample_rate, channels)
+        write_wav(path + ".part", noisy, sample_rate)
+        os.replace(path + ".part", path)
+    return path
@@ -0,0 +1,285 @@
+# benchmarks/run.py
+#
+# Benchmark dei percorsi critici: singoli step di pulizia, decodifica/codifica,
+# pipeline completa (in memoria e in streaming), pulizia tramite process pool
+# come nel bot e trascrizione contro uno stub locale dell'API.
+#
+# Ogni caso gira in un processo separato, così il picco di memoria (RSS) è
+# misurato per caso. Per ogni caso si riportano tempo reale, tempo CPU (inclusi
+# i processi figli: ffmpeg e worker del pool), picco di RSS e throughput in
+# secondi di audio elaborati per secondo reale.
+#
+# Uso:
+#   python -m benchmarks.run [--matrix quick|full] [--stages denoise,pipeline] [--output risultati.json]
+#   python -m benchmarks.run --compare baseline.json --output nuovi.json [--threshold 0.10]
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import DEFAULT_FIXTURE_DIR, fixture_path, read_wav
+
+MATRICES = {
+    'quick': {'seconds': [10, 60], 'sample_rates': [16000, 44100], 'channels': [1, 2]},
+    'full': {'seconds': [10, 60, 600], 'sample_rates': [16000, 44100, 48000], 'channels': [1, 2]},
+}
+STAGES = [
+    'decode', 'normalize', 'denoise', 'highpass', 'lowpass', 'butter_filter', 'encode',
+    'pipeline', 'streaming', 'clean_audio', 'transcribe',
+]
+# Step che richiedono ffmpeg/ffprobe
+FFMPEG_STAGES = {'decode', 'encode', 'pipeline', 'streaming', 'clean_audio', 'transcribe'}
+
+
+###############################
+# Esecuzione di un singolo caso #
+###############################
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _peak_rss_mb():
+    # Su Linux ru_maxrss è in KiB
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / 1024
+
+
+# Prepara la funzione da misurare; il lavoro di preparazione non entra nelle misure
+def _prepare(case, workdir):
+    stage, path = case['stage'], case['fixture']
+
+    if stage == 'decode':
+        from audio.pipeline import decode_audio
+        return lambda: decode_audio(path)
+
+    if stage == 'encode':
+        from audio.pipeline import encode_audio
+        y, sample_rate = read_wav(path)
+        return lambda: encode_audio(y, sample_rate, os.path.join(workdir, "out"))
+
+    if stage in ('normalize', 'denoise', 'highpass', 'lowpass'):
+        from audio.pipeline import apply_stage
+        y, sample_rate = read_wav(path)
+        return lambda: apply_stage(stage, y, sample_rate)
+
+    if stage == 'butter_filter':
+        from audio.audio_utils import butter_filter
+        y, sample_rate = read_wav(path)
+        return lambda: butter_filter(y, 300, 3000, sample_rate, btype='band')
+
+    if stage in ('pipeline', 'streaming'):
+        from audio.audio_utils import clean_file
+        streaming = stage == 'streaming'
+        return lambda: clean_file(path, os.path.join(workdir, "out"), streaming=streaming)
+
+    if stage in ('clean_audio', 'transcribe'):
+        from utils.executor import configure_executor, get_executor
+
+    if stage == 'clean_audio':
+        # Percorso del bot: pulizia nel process pool, con avvio e chiusura del pool
+        from audio.audio_utils import clean_audio
+
+        async def run_clean():
+            configure_executor(max_workers=1)
+            try:
+                # clean_audio registra l'errore e restituisce None: il caso va riportato come 'error'
+                result = await clean_audio(path, "out", output_dir=workdir)
+                if result is None:
+                    raise RuntimeError("clean_audio non ha prodotto alcun file (dettagli nel log)")
+                return result
+            finally:
+                # I worker vanno attesi perché il loro tempo CPU venga conteggiato
+                get_executor().shutdown(wait=True)
+        return lambda: asyncio.run(run_clean())
+
+    if stage == 'transcribe':
+        from openai_utils.openai_helper import setup_openai, close_openai, transcribe_audio_with_whisper
+
+        async def run_transcribe():
+            configure_executor(max_workers=os.cpu_count() or 1, max_queued=64)
+            setup_openai("benchmark", base_url=case['stub_url'])
+            try:
+                result = await transcribe_audio_with_whisper(path)
+                if result is None:
+                    raise RuntimeError("la trascrizione non è riuscita (dettagli nel log)")
+                return result
+            finally:
+                await close_openai()
+                get_executor().shutdown(wait=True)
+        return lambda: asyncio.run(run_transcribe())
+
+    raise ValueError(f"Step di benchmark sconosciuto: {stage}")
+
+
+def run_case(case):
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        func = _prepare(case, workdir)
+        setup_rss = _peak_rss_mb()
+        best = None
+        for _ in range(case['repeat']):
+            cpu_start, wall_start = _cpu_seconds(), time.perf_counter()
+            func()
+            wall, cpu = time.perf_counter() - wall_start, _cpu_seconds() - cpu_start
+            if best is None or wall < best[0]:
+                best = (wall, cpu)
+    wall, cpu = best
+    return dict(case, fixture=os.path.basename(case['fixture']), status='ok', wall_seconds=wall,
+                cpu_seconds=cpu, setup_rss_mb=setup_rss, peak_rss_mb=_peak_rss_mb(),
+                throughput=case['seconds'] / wall if wall > 0 else None)
+
+
+# Esegue il caso in un processo nuovo e ne legge il risultato JSON
+def run_case_isolated(case):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", "--run-case", json.dumps(case)],
+        capture_output=True, text=True,
+    )
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        error = result.stderr.strip().splitlines()[-1:] or ["errore sconosciuto"]
+        return dict(case, fixture=os.path.basename(case['fixture']), status='error', error=error[0])
+    return json.loads(lines[-1])
+
+
+#####################
+# Stub di Whisper   #
+#####################
+
+def start_stub(latency):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_server", "--latency", str(latency)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    url = process.stdout.readline().strip()
+    if not url:
+        process.kill()
+        raise RuntimeError("Lo stub dell'API di trascrizione non si è avviato.")
+    return process, url
+
+
+###########################
+# Report e confronto      #
+###########################
+
+def case_key(result):
+    return (result['stage'], result['seconds'], result['sample_rate'], result['channels'])
+
+
+def print_results(results):
+    print(f"{'step':<14}{'audio':>16}{'tempo (s)':>11}{'CPU (s)':>10}{'RSS (MB)':>10}{'x tempo reale':>15}")
+    for r in results:
+        audio = f"{r['seconds']:g}s {r['sample_rate'] // 1000}k {r['channels']}ch"
+        if r['status'] != 'ok':
+            print(f"{r['stage']:<14}{audio:>16}  {r['status']}: {r.get('error', '')}")
+            continue
+        print(f"{r['stage']:<14}{audio:>16}{r['wall_seconds']:>11.3f}{r['cpu_seconds']:>10.3f}"
+              f"{r['peak_rss_mb']:>10.1f}{r['throughput']:>15.1f}")
+
+
+# Confronta con un file di risultati precedente; restituisce il numero di regressioni
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {case_key(r): r for r in json.load(f)['results'] if r['status'] == 'ok'}
+    regressions = 0
+    print(f"\nConfronto con {baseline_path} (soglia {threshold:.0%}):")
+    print(f"{'step':<14}{'audio':>16}{'tempo':>10}{'RSS':>10}")
+    for r in results:
+        old = baseline.get(case_key(r))
+        if r['status'] != 'ok' or old is None:
+            continue
+        wall_delta = r['wall_seconds'] / old['wall_seconds'] - 1
+        rss_delta = r['peak_rss_mb'] / old['peak_rss_mb'] - 1
+        flag = ""
+        if wall_delta > threshold or rss_delta > threshold:
+            flag = "  REGRESSIONE"
+            regressions += 1
+        audio = f"{r['seconds']:g}s {r['sample_rate'] // 1000}k {r['channels']}ch"
+        print(f"{r['stage']:<14}{audio:>16}{wall_delta:>+10.1%}{rss_delta:>+10.1%}{flag}")
+    return regressions
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.time(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': shutil.which("ffmpeg") is not None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della pulizia e della trascrizione audio.")
+    parser.add_argument("--matrix", choices=sorted(MATRICES), default='quick')
+    parser.add_argument("--stages", default=",".join(STAGES), help="Step da misurare, separati da virgola")
+    parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni per caso (si tiene la migliore)")
+    parser.add_argument("--fixture-dir", default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="Latenza simulata dell'API (s)")
+    parser.add_argument("--output", help="File JSON in cui salvare i risultati")
+    parser.add_argument("--compare", help="File JSON di riferimento per il confronto")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Peggioramento tollerato nel confronto")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return 0
+
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"step sconosciuti: {', '.join(sorted(unknown))}")
+    has_ffmpeg = shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+    stub, stub_url = None, None
+    if 'transcribe' in stages and has_ffmpeg:
+        stub, stub_url = start_stub(args.stub_latency)
+
+    matrix = MATRICES[args.matrix]
+    results = []
+    try:
+        for seconds in matrix['seconds']:
+            for sample_rate in matrix['sample_rates']:
+                for channels in matrix['channels']:
+                    path = fixture_path(seconds, sample_rate, channels, args.fixture_dir)
+                    for stage in stages:
+                        case = {'stage': stage, 'seconds': seconds, 'sample_rate': sample_rate,
+                                'channels': channels, 'repeat': args.repeat, 'fixture': path, 'stub_url': stub_url}
+                        if stage in FFMPEG_STAGES and not has_ffmpeg:
+                            results.append(dict(case, fixture=os.path.basename(path), status='skipped',
+                                                error="ffmpeg non disponibile"))
+                            continue
+                        results.append(run_case_isolated(case))
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'metadata': metadata(), 'results': results}, f, indent=2)
+        print(f"\nRisultati salvati in {args.output}.")
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
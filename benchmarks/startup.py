@@ -0,0 +1,118 @@
+# benchmarks/startup.py
+#
+# Tempo di avvio del processo del bot: import di bot.main e creazione
+# dell'applicazione Telegram (handler e persistenza), cioè quanto passa prima
+# che il bot possa rispondere al primo update. Ogni misura gira in un
+# interprete nuovo, come un container appena avviato.
+#
+# Il comando fallisce (codice 1) se la mediana supera il budget o se all'avvio
+# vengono caricati moduli pesanti che devono restare lazy (stack audio, docx).
+#
+# Uso:
+#   python -m benchmarks.startup [--repeat 5] [--budget-ms 500] [--output avvio.json]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Moduli che non devono essere importati all'avvio del bot
+LAZY_MODULES = ('numpy', 'scipy', 'pydub', 'noisereduce', 'docx', 'lxml', 'openai')
+
+# Eseguito in un interprete nuovo: misura import e creazione dell'applicazione
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import bot.main
+imported = time.perf_counter()
+from bot.persistence import SQLitePersistence
+bot.main.build_application(SQLitePersistence(sys.argv[1]))
+built = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'build_ms': (built - imported) * 1000,
+    'loaded': [name for name in sys.argv[2].split(',') if name in sys.modules],
+}))
+"""
+
+
+def _environment():
+    env = dict(os.environ)
+    # Token fittizio: la creazione dell'applicazione non contatta Telegram
+    env.setdefault('TELEGRAM_BOT_TOKEN', '123456:startup-benchmark')
+    env['LOG_LEVEL'] = 'WARNING'
+    return env
+
+
+def measure_once(workdir):
+    state_path = os.path.join(workdir, f"state_{os.getpid()}.sqlite3")
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE, state_path, ",".join(LAZY_MODULES)],
+        capture_output=True, text=True, env=_environment(),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "errore sconosciuto")
+    os.remove(state_path)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# Moduli più lenti da importare, dall'output di -X importtime
+def slowest_imports(limit=10):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import bot.main"],
+        capture_output=True, text=True, env=_environment(),
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules.append((int(cumulative) / 1000, name.strip()))
+    return sorted(modules, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del tempo di avvio del bot.")
+    parser.add_argument("--repeat", type=int, default=5, help="Avvii misurati (si riporta la mediana)")
+    parser.add_argument("--budget-ms", type=float, default=500.0,
+                        help="Tempo massimo per import e creazione dell'applicazione")
+    parser.add_argument("--output", help="File JSON in cui salvare i risultati")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="startup-") as workdir:
+        runs = [measure_once(workdir) for _ in range(args.repeat)]
+    import_ms = statistics.median(run['import_ms'] for run in runs)
+    build_ms = statistics.median(run['build_ms'] for run in runs)
+    total_ms = statistics.median(run['import_ms'] + run['build_ms'] for run in runs)
+    loaded = sorted({name for run in runs for name in run['loaded']})
+
+    for label, value in (("import di bot.main", import_ms), ("creazione dell'applicazione", build_ms),
+                         ("totale (mediana)", total_ms)):
+        print(f"{label:<30}{value:8.1f} ms")
+    print(f"{'budget':<30}{args.budget_ms:8.0f} ms")
+    print("\nImport più lenti (cumulativi):")
+    for ms, name in slowest_imports():
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"avvio oltre il budget: {total_ms:.1f} ms > {args.budget_ms:.0f} ms")
+    if loaded:
+        failures.append(f"moduli pesanti importati all'avvio: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"\nERRORE: {failure}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'import_ms': import_ms, 'build_ms': build_ms, 'total_ms': total_ms,
+                       'budget_ms': args.budget_ms, 'loaded': loaded, 'runs': runs}, f, indent=2)
+        print(f"\nRisultati salvati in {args.output}.")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
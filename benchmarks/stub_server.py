@@ -0,0 +1,49 @@
+# benchmarks/stub_server.py
+#
+# Server locale che imita l'endpoint /audio/transcriptions di OpenAI, per
+# misurare il percorso di trascrizione senza rete e senza costi.
+#
+# Uso: python -m benchmarks.stub_server [--port 0] [--latency 0.2]
+
+import argparse
+import asyncio
+from aiohttp import web
+
+
+async def handle_transcription(request):
+    form = await request.post()
+    audio = form['file']
+    await asyncio.sleep(request.app['latency'])
+    size = len(audio.file.read())
+    return web.json_response({'text': f"trascrizione di {audio.filename} ({size} byte)"})
+
+
+def create_stub_app(latency=0.2):
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    app['latency'] = latency
+    app.router.add_post("/v1/audio/transcriptions", handle_transcription)
+    return app
+
+
+async def serve(host, port, latency):
+    runner = web.AppRunner(create_stub_app(latency))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    # La prima riga su stdout comunica l'URL al processo che ha avviato lo stub
+    print(f"http://{host}:{port}/v1", flush=True)
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub locale dell'API di trascrizione.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.2, help="Latenza simulata per richiesta (s)")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# bot/batch.py
+
+import asyncio
+import os
+import zipfile
+from collections import namedtuple
+from audio.ffmpeg_io import AUDIO_EXTENSIONS
+from audio.encoding import DEFAULT_PROFILE, get_profile
+from bot.cache_utils import get_or_compute, compute_cached
+from bot.dispatcher import get_dispatcher
+from bot.bot_utils import send_document_to_user
+from bot.ingest import AudioInput
+from utils import logger
+from utils.workspace import safe_filename
+
+# Limiti dell'elaborazione in batch
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 100))
+# File elaborati contemporaneamente da tutti i batch attivi (budget globale)
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 4))
+# Dimensione massima di ciascun archivio inviato (limite dei bot Telegram: 50 MB)
+MAX_ARCHIVE_PART_BYTES = 45 * 1024 * 1024
+
+# Un file del batch: un allegato di Telegram (`item`) o un file estratto da un archivio (`audio_input`)
+BatchEntry = namedtuple('BatchEntry', ['index', 'name', 'item', 'audio_input'])
+
+_slots = None
+
+
+def _batch_slots():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    return _slots
+
+
+def _stem(filename):
+    return os.path.splitext(os.path.basename(filename))[0] or "audio"
+
+
+# Estrae dal messaggio il file da aggiungere al batch (None se non è un audio o un archivio zip)
+def batch_item_from_message(message, position):
+    audio = message.audio or message.voice
+    document = message.document
+    if audio is None and document is not None:
+        extension = os.path.splitext(document.file_name or '')[1].lower()
+        if extension == '.zip':
+            return {'type': 'archive', 'file_id': document.file_id, 'file_unique_id': document.file_unique_id,
+                    'name': document.file_name}
+        if extension in AUDIO_EXTENSIONS or (document.mime_type or '').startswith('audio/'):
+            audio = document
+    if audio is None:
+        return None
+    filename = getattr(audio, 'file_name', None)
+    return {'type': 'telegram', 'file_id': audio.file_id, 'file_unique_id': audio.file_unique_id,
+            'name': _stem(filename) if filename else f"audio_{position}", 'filename': filename or "audio.ogg",
+            'duration': getattr(audio, 'duration', None)}
+
+
+# Copia un membro dell'archivio fermandosi a `max_bytes`: la dimensione dichiarata nello zip
+# (usata per la quota) non è affidabile
+def _copy_member(src, dst, max_bytes, chunk_size=1024 * 1024):
+    copied = 0
+    while True:
+        chunk = src.read(min(chunk_size, max_bytes - copied + 1))
+        if not chunk:
+            return copied
+        copied += len(chunk)
+        if copied > max_bytes:
+            raise ValueError(f"contenuto oltre la dimensione dichiarata di {max_bytes} byte")
+        dst.write(chunk)
+
+
+def _extract_archive(path, workspace, first_index, limit=BATCH_MAX_ITEMS):
+    with zipfile.ZipFile(path) as archive:
+        infos = [
+            info for info in archive.infolist()
+            if not info.is_dir()
+            and not os.path.basename(info.filename).startswith('.')
+            and not info.filename.startswith('__MACOSX')
+            and os.path.splitext(info.filename)[1].lower() in AUDIO_EXTENSIONS
+        ]
+        # Solo i file che rientrano nel limite del batch vengono estratti
+        infos = infos[:max(limit, 0)]
+        # Controllo della quota sulla dimensione decompressa, prima di estrarre
+        workspace.reserve(sum(info.file_size for info in infos))
+        entries = []
+        for info in infos:
+            filename = os.path.basename(info.filename)
+            index = first_index + len(entries)
+            target = workspace.path_for(f"{index:03d}_{filename}")
+            try:
+                with archive.open(info) as src, open(target, 'wb') as dst:
+                    _copy_member(src, dst, info.file_size)
+            except (ValueError, zipfile.BadZipFile) as e:
+                os.remove(target)
+                logger.warning(f"File {info.filename} dell'archivio scartato: {e}")
+                continue
+            entries.append(BatchEntry(index, _stem(filename), None, AudioInput(path=target, filename=filename)))
+    return entries
+
+
+# Espande gli archivi zip nei file audio che contengono, fino a BATCH_MAX_ITEMS file
+async def expand_items(bot, items, workspace):
+    entries = []
+    for item in items:
+        if len(entries) >= BATCH_MAX_ITEMS:
+            logger.warning(f"Batch oltre il limite di {BATCH_MAX_ITEMS} file: gli elementi successivi sono ignorati.")
+            break
+        if item['type'] != 'archive':
+            entries.append(BatchEntry(len(entries), item['name'], item, None))
+            continue
+        file = await bot.get_file(item['file_id'])
+        workspace.reserve(file.file_size or 0)
+        path = await file.download_to_drive(custom_path=workspace.path_for(item['name']))
+        extracted = await asyncio.to_thread(_extract_archive, path, workspace, len(entries),
+                                            BATCH_MAX_ITEMS - len(entries))
+        os.remove(path)
+        logger.info(f"Archivio {item['name']}: {len(extracted)} file audio estratti.")
+        entries.extend(extracted)
+    return entries
+
+
+class BatchProgress:
+    """
+    Messaggio di avanzamento unico per tutto il batch, modificato sul posto.
+    Se arrivano più aggiornamenti mentre una modifica è in corso, viene
+    inviato solo l'ultimo.
+    """
+
+    def __init__(self, bot, chat_id, title, total):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.title = title
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.message_id = None
+        self._editing = False
+        self._dirty = False
+
+    def text(self):
+        text = f"{self.title}: {self.completed + self.failed}/{self.total} file elaborati"
+        if self.failed:
+            text += f" ({self.failed} non riusciti)"
+        return text
+
+    async def start(self):
+        message = await get_dispatcher(self.bot).submit(
+            self.chat_id, lambda: self.bot.send_message(chat_id=self.chat_id, text=self.text())
+        )
+        self.message_id = message.message_id
+
+    def advance(self, ok):
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+        self._schedule()
+
+    def _edit(self):
+        text = self.text()
+        return get_dispatcher(self.bot).submit(
+            self.chat_id,
+            lambda: self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.message_id),
+        )
+
+    def _schedule(self):
+        if self.message_id is None:
+            return
+        if self._editing:
+            self._dirty = True
+            return
+        self._editing = True
+        self._edit().add_done_callback(self._edited)
+
+    def _edited(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Aggiornamento dell'avanzamento non riuscito: {future.exception()}")
+        self._editing = False
+        if self._dirty:
+            self._dirty = False
+            self._schedule()
+
+
+# Elabora tutti i file del batch in parallelo, entro il budget globale
+async def run_batch(bot, chat_id, entries, workspace, kind, params, make_compute, title):
+    """
+    `make_compute(entry)` restituisce la funzione di calcolo del singolo file
+    (la stessa usata per /transcribe o /clean). I risultati già in cache non
+    vengono ricalcolati e ognuno viene scritto nel workspace, così la memoria
+    usata non cresce con il numero di file. Restituisce la lista di
+    (entry, percorso del risultato o None).
+    """
+    progress = BatchProgress(bot, chat_id, title, len(entries))
+    await progress.start()
+
+    async def process(entry):
+        async with _batch_slots():
+            try:
+                if entry.item is not None:
+                    # Nome del download distinto per ogni file: il workspace è condiviso dal batch
+                    value = await get_or_compute(bot, kind, params, entry.item['file_id'],
+                                                 entry.item['file_unique_id'], workspace, make_compute(entry),
+                                                 filename=f"{entry.index:03d}_{entry.item['filename']}",
+                                                 duration=entry.item.get('duration'))
+                else:
+                    _, value = await compute_cached(kind, params, entry.audio_input, make_compute(entry))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Errore durante l'elaborazione di {entry.name} nel batch: {e}")
+                value = None
+        progress.advance(value is not None)
+        if value is None:
+            return entry, None
+        path = workspace.path_for(f"result_{entry.index:03d}")
+        await asyncio.to_thread(_write_file, path, value)
+        return entry, path
+
+    return await asyncio.gather(*(process(entry) for entry in entries))
+
+
+def _write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_transcripts_docx(results, path, title):
+    # python-docx (con lxml) è pesante da importare: viene caricato al primo batch, fuori dall'event loop
+    from docx import Document
+
+    document = Document()
+    document.add_heading(title, level=1)
+    for entry, result_path in results:
+        document.add_heading(entry.name, level=2)
+        if result_path:
+            with open(result_path, 'r', encoding='utf-8') as f:
+                document.add_paragraph(f.read())
+        else:
+            document.add_paragraph("Trascrizione non riuscita.")
+    document.save(path)
+    return path
+
+
+# Invia tutte le trascrizioni in un unico documento DOCX
+async def deliver_transcripts(bot, chat_id, results, workspace, title):
+    path = workspace.path_for(f"{safe_filename(title)}.docx")
+    await asyncio.to_thread(_write_transcripts_docx, results, path, title)
+    completed = sum(1 for _, result_path in results if result_path)
+    await send_document_to_user(bot, chat_id, path, f"{completed} trascrizioni su {len(results)}.")
+
+
+def _write_archives(results, workspace, basename, extension):
+    parts = []
+    archive, size = None, 0
+    for entry, result_path in results:
+        if not result_path:
+            continue
+        file_size = os.path.getsize(result_path)
+        if archive is None or size + file_size > MAX_ARCHIVE_PART_BYTES:
+            if archive is not None:
+                archive.close()
+            parts.append(workspace.path_for(f"{basename}_{len(parts) + 1}.zip"))
+            # Gli audio sono già compressi: nessuna ulteriore compressione
+            archive, size = zipfile.ZipFile(parts[-1], 'w', compression=zipfile.ZIP_STORED), 0
+        archive.write(result_path, safe_filename(f"{entry.index + 1:02d}_{entry.name}_cleaned{extension}"))
+        size += file_size
+    if archive is not None:
+        archive.close()
+    return parts
+
+
+# Invia gli audio puliti in uno o più archivi zip
+async def deliver_cleaned(bot, chat_id, results, workspace, title, extension=None):
+    extension = extension or get_profile(DEFAULT_PROFILE).extension
+    parts = await asyncio.to_thread(_write_archives, results, workspace, safe_filename(title), extension)
+    completed = sum(1 for _, result_path in results if result_path)
+    for number, path in enumerate(parts, start=1):
+        caption = f"{completed} file puliti su {len(results)}."
+        if len(parts) > 1:
+            caption += f" Parte {number} di {len(parts)}."
+        await send_document_to_user(bot, chat_id, path, caption)
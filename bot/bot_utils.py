@@ -1,24 +1,48 @@
 # bot/bot_utils.py
 
 from utils import logger  # Usa il logger da utils
+from bot.dispatcher import get_dispatcher
+from utils.progress import ProgressSink
 
 # Funzione per inviare un messaggio di testo generico all'utente Telegram
 async def send_message(bot, user_id, message, parse_mode=None):
     """
-    Invia un messaggio generico all'utente tramite il bot Telegram.
+    Invia un messaggio generico all'utente tramite il bot Telegram, rispettando
+    i limiti di frequenza (coda di invio in bot/dispatcher.py).
     """
     try:
-        await bot.send_message(chat_id=user_id, text=message, parse_mode=parse_mode)
-        logger.info(f"Messaggio inviato all'utente {user_id}: {message}")
+        await get_dispatcher(bot).submit(
+            user_id, lambda: bot.send_message(chat_id=user_id, text=message, parse_mode=parse_mode)
+        )
+        logger.debug(f"Messaggio inviato all'utente {user_id} ({len(message)} caratteri).", extra={'user_id': user_id})
     except Exception as e:
         logger.error(f"Errore durante l'invio del messaggio all'utente {user_id}: {e}")
 
 # Funzione per inviare log all'utente Telegram
 async def send_log_to_user(bot, user_id, message):
     """
-    Invia un messaggio di log all'utente tramite il bot Telegram.
+    Accoda un messaggio di log per l'utente senza attenderne l'invio. Le righe
+    consecutive vengono accorpate in un unico messaggio di avanzamento.
     """
-    await send_message(bot, user_id, message)  # Usa await per inviare il log
+    get_dispatcher(bot).log(user_id, message)
+    # Righe ad alto volume: campionate per utente dal logging (utils/logging_config.py)
+    logger.info(f"Avanzamento per l'utente {user_id}: {message}", extra={'user_id': user_id})
+
+# Messaggi di avanzamento inviati nella chat dell'utente
+class TelegramProgress(ProgressSink):
+    def __init__(self, bot, user_id):
+        self.bot = bot
+        self.user_id = user_id
+
+    async def log(self, message):
+        await send_log_to_user(self.bot, self.user_id, message)
+
+# Invia un file aprendolo a ogni tentativo, così un eventuale nuovo invio dopo RetryAfter riparte dall'inizio
+async def _send_file(bot, user_id, path, send):
+    async def call():
+        with open(path, 'rb') as file:
+            return await send(file)
+    return await get_dispatcher(bot).submit(user_id, call)
 
 # Funzione per inviare un file audio all'utente Telegram
 async def send_audio_to_user(bot, user_id, audio_path, caption):
@@ -26,8 +50,8 @@ async def send_audio_to_user(bot, user_id, audio_path, caption):
     Invia un file audio all'utente tramite il bot Telegram.
     """
     try:
-        with open(audio_path, 'rb') as audio_file:
-            await bot.send_audio(chat_id=user_id, audio=audio_file, caption=caption)
+        await _send_file(bot, user_id, audio_path,
+                         lambda audio_file: bot.send_audio(chat_id=user_id, audio=audio_file, caption=caption))
         logger.info(f"File audio inviato all'utente {user_id}: {audio_path}")
     except Exception as e:
         logger.error(f"Errore durante l'invio dell'audio all'utente {user_id}: {e}")
@@ -38,8 +62,8 @@ async def send_document_to_user(bot, user_id, document_path, caption):
     Invia un documento all'utente tramite il bot Telegram.
     """
     try:
-        with open(document_path, 'rb') as doc_file:
-            await bot.send_document(chat_id=user_id, document=doc_file, caption=caption)
+        await _send_file(bot, user_id, document_path,
+                         lambda doc_file: bot.send_document(chat_id=user_id, document=doc_file, caption=caption))
         logger.info(f"Documento inviato all'utente {user_id}: {document_path}")
     except Exception as e:
         logger.error(f"Errore durante l'invio del documento all'utente {user_id}: {e}")
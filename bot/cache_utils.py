@@ -0,0 +1,52 @@
+# bot/cache_utils.py
+
+import asyncio
+from utils import logger
+from utils.cache import get_cache, make_key
+from bot.ingest import ingest_audio, hash_audio
+
+# Funzione per ottenere un risultato dalla cache o calcolarlo
+async def get_or_compute(bot, kind, params, file_id, file_unique_id, workspace, compute, filename="audio.ogg",
+                         duration=None):
+    """
+    Restituisce i byte del risultato in cache per l'audio indicato, oppure li
+    calcola con `compute(audio_input)` e li salva. Il file viene scaricato in
+    memoria o, se grande, nel `workspace` del job. Il `file_unique_id` di
+    Telegram permette di evitare anche il download quando il file è già stato
+    elaborato. `duration` è la durata dichiarata da Telegram per l'audio.
+    """
+    cache = get_cache()
+    alias = make_key(kind, f"telegram:{file_unique_id}", params)
+
+    key = await asyncio.to_thread(cache.resolve_alias, alias)
+    if key is not None:
+        value = await asyncio.to_thread(cache.get, key, kind)
+        if value is not None:
+            logger.info(f"Risultato {kind} servito dalla cache senza download ({file_unique_id}).")
+            return value
+
+    file = await bot.get_file(file_id)
+    audio_input = await ingest_audio(file, workspace, filename=filename, duration=duration)
+
+    key, value = await compute_cached(kind, params, audio_input, compute)
+    if value is None:
+        return None
+    await asyncio.to_thread(cache.add_alias, alias, key)
+    return value
+
+# Funzione per ottenere dalla cache, o calcolare, il risultato di un audio già disponibile
+async def compute_cached(kind, params, audio_input, compute):
+    """
+    Cerca il risultato per hash del contenuto e, se manca, lo calcola con
+    `compute(audio_input)` e lo salva. Restituisce (chiave, byte del risultato o None).
+    """
+    cache = get_cache()
+    key = make_key(kind, await hash_audio(audio_input), params)
+    value = await asyncio.to_thread(cache.get, key, kind)
+    if value is None:
+        value = await compute(audio_input)
+        if value is not None:
+            await asyncio.to_thread(cache.put, key, kind, value)
+    else:
+        logger.info(f"Risultato {kind} servito dalla cache ({key[:12]}).")
+    return key, value
@@ -1,25 +1,16 @@
 import os
 import logging
 from dotenv import load_dotenv
-import subprocess
 
-# Carica le variabili d'ambiente dal file .env
+# Carica le variabili d'ambiente dal file .env, prima della configurazione del logging
+# che legge LOG_LEVEL, LOG_FORMAT, LOG_FILE e LOG_SAMPLE_* quando viene importata
 load_dotenv()
 
-# Configura il logging
-def setup_logging():
-    log_file_path = os.path.join(os.path.dirname(__file__), 'config.log')
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO,
-        handlers=[
-            logging.FileHandler(log_file_path),  # Salva i log in un file
-            logging.StreamHandler()  # Mostra i log sulla console
-        ]
-    )
-    return logging.getLogger(__name__)
-
-logger = setup_logging()
+import utils.logging_config  # noqa: E402,F401  Configura il logging globale
+import subprocess  # noqa: E402
+
+# Il logging è configurato in utils/logging_config.py (coda e thread di scrittura unici)
+logger = logging.getLogger(__name__)
 
 # Recupera la chiave API da .env
 def get_openai_api_key():
@@ -53,3 +44,87 @@ def verify_ffmpeg():
             logger.error(f"Errore nell'esecuzione di ffmpeg: {result.stderr}")
     except FileNotFoundError:
         logger.error("ffmpeg non è stato trovato nell'ambiente.")
+
+# Recupera la configurazione del process pool per l'elaborazione audio
+def get_executor_settings():
+    max_workers = int(os.getenv('JOB_WORKERS', os.cpu_count() or 1))
+    max_queued = int(os.getenv('JOB_QUEUE_SIZE', max_workers * 2))
+    timeout = float(os.getenv('JOB_TIMEOUT', 15 * 60))
+    logger.info(f"Executor: {max_workers} worker, coda massima {max_queued}, timeout {timeout} s.")
+    return max_workers, max_queued, timeout
+
+# Recupera la configurazione dell'avvio: preriscaldamento dei moduli e pre-fork del process pool
+def get_startup_settings():
+    settings = {
+        'warm_imports': os.getenv('WARM_IMPORTS', '1') != '0',
+        'prefork': os.getenv('PREFORK_WORKERS', '0') == '1',
+    }
+    logger.info(f"Avvio: preriscaldamento dei moduli {'attivo' if settings['warm_imports'] else 'disattivato'}, "
+                f"pre-fork del process pool {'attivo' if settings['prefork'] else 'disattivato'}.")
+    return settings
+
+# Recupera la configurazione del client di trascrizione Whisper
+def get_whisper_settings():
+    settings = {
+        'base_url': os.getenv('OPENAI_BASE_URL') or None,
+        'max_in_flight': int(os.getenv('WHISPER_MAX_IN_FLIGHT', 4)),
+        'max_retries': int(os.getenv('WHISPER_MAX_RETRIES', 4)),
+        'timeout': float(os.getenv('WHISPER_TIMEOUT', 120)),
+    }
+    logger.info(f"Whisper: massimo {settings['max_in_flight']} richieste contemporanee, {settings['max_retries']} tentativi.")
+    return settings
+
+# Recupera la configurazione della cache dei risultati
+def get_cache_settings():
+    db_path = os.getenv('CACHE_DB_PATH', os.path.join('cache', 'results.sqlite3'))
+    max_bytes = int(os.getenv('CACHE_MAX_MB', 1024)) * 1024 * 1024
+    logger.info(f"Cache dei risultati in {db_path}, dimensione massima {max_bytes // (1024 * 1024)} MB.")
+    return db_path, max_bytes
+
+# Recupera il percorso dell'archivio dei profili di rumore per ambiente
+def get_profile_store_settings():
+    db_path = os.getenv('NOISE_PROFILES_DB_PATH', os.path.join('data', 'noise_profiles.sqlite3'))
+    logger.info(f"Profili di rumore in {db_path}.")
+    return db_path
+
+# Recupera la configurazione dei workspace temporanei dei job
+def get_workspace_settings():
+    root = os.getenv('WORKSPACE_ROOT') or None
+    quota_bytes = int(os.getenv('WORKSPACE_QUOTA_MB', 2048)) * 1024 * 1024
+    max_age = float(os.getenv('WORKSPACE_MAX_AGE', 60 * 60))
+    return root, quota_bytes, max_age
+
+# Recupera la configurazione dell'endpoint delle metriche (disattivato se METRICS_PORT non è impostata)
+def get_metrics_settings():
+    port = os.getenv('METRICS_PORT')
+    return {
+        'port': int(port) if port else None,
+        'host': os.getenv('METRICS_HOST', '127.0.0.1'),
+    }
+
+# Modalità di esecuzione: polling (processo singolo), webhook (server che accoda gli update) o worker
+def get_bot_mode():
+    mode = os.getenv('BOT_MODE', 'polling').strip().lower()
+    if mode not in ('polling', 'webhook', 'worker'):
+        logger.error(f"BOT_MODE non valido: {mode}. Valori ammessi: polling, webhook, worker.")
+        exit(1)
+    return mode
+
+# Recupera la configurazione del server webhook
+def get_webhook_settings():
+    return {
+        'host': os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+        'port': int(os.getenv('WEBHOOK_PORT', 8080)),
+        'path': os.getenv('WEBHOOK_PATH', 'telegram').strip('/'),
+        'url': os.getenv('WEBHOOK_URL') or None,
+        'secret_token': os.getenv('WEBHOOK_SECRET') or None,
+    }
+
+# Recupera la configurazione della coda degli update e della persistenza condivisa
+def get_queue_settings():
+    return {
+        'queue_path': os.getenv('UPDATE_QUEUE_PATH', os.path.join('data', 'updates.sqlite3')),
+        'state_path': os.getenv('STATE_DB_PATH', os.path.join('data', 'state.sqlite3')),
+        'lease_seconds': float(os.getenv('UPDATE_LEASE_SECONDS', 120)),
+        'concurrency': int(os.getenv('WORKER_CONCURRENCY', 8)),
+    }
@@ -0,0 +1,210 @@
+# bot/dispatcher.py
+
+import asyncio
+import time
+from telegram.error import BadRequest, RetryAfter
+from utils import logger
+
+# Limiti di Telegram: ~30 messaggi/s globali e ~1 messaggio/s per chat (con un piccolo burst)
+GLOBAL_RATE = 25.0
+GLOBAL_BURST = 25
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+# Attesa prima di aggiornare il messaggio di avanzamento, per accorpare più righe di log
+COALESCE_DELAY = 0.5
+MAX_RETRIES = 3
+# Un worker di chat inattivo per più di questo tempo viene chiuso
+WORKER_IDLE_SECONDS = 60.0
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """Rate limiter a token bucket: `rate` token al secondo, al massimo `capacity` accumulati."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _ProgressMessage:
+    """Messaggio di avanzamento di una chat, modificato man mano che arrivano nuovi log."""
+
+    def __init__(self):
+        self.message_id = None
+        self.lines = []
+        self.pending = []
+        self.scheduled = False
+
+
+class OutboundDispatcher:
+    """
+    Coda di invio verso Telegram con rate limiting globale e per chat. Ogni chat
+    ha un worker che invia i messaggi in ordine; le righe di log consecutive
+    vengono accorpate in un unico messaggio di avanzamento modificato sul posto.
+    """
+
+    def __init__(self, bot, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, coalesce_delay=COALESCE_DELAY, max_retries=MAX_RETRIES):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.coalesce_delay = coalesce_delay
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets = {}
+        self._queues = {}
+        self._workers = {}
+        self._progress = {}
+
+    def _queue_for(self, chat_id):
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = asyncio.Queue()
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.create_task(self._worker(chat_id, queue))
+        return queue
+
+    async def _throttle(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        await bucket.acquire()
+        await self._global_bucket.acquire()
+
+    async def _call(self, chat_id, factory):
+        for attempt in range(self.max_retries + 1):
+            await self._throttle(chat_id)
+            try:
+                return await factory()
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood control per la chat {chat_id}: nuovo tentativo tra {e.retry_after} s.")
+                await asyncio.sleep(e.retry_after)
+
+    async def _worker(self, chat_id, queue):
+        while True:
+            try:
+                operation = await asyncio.wait_for(queue.get(), WORKER_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    self._queues.pop(chat_id, None)
+                    self._workers.pop(chat_id, None)
+                    self._chat_buckets.pop(chat_id, None)
+                    self._progress.pop(chat_id, None)
+                    return
+                continue
+            try:
+                if operation is None:
+                    await self._flush_progress(chat_id)
+                else:
+                    factory, future = operation
+                    try:
+                        result = await self._call(chat_id, factory)
+                        if not future.done():
+                            future.set_result(result)
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    # Dopo un messaggio normale, i log successivi iniziano un nuovo messaggio di avanzamento;
+                    # le righe già accodate e il loro flush restano validi
+                    progress = self._progress.get(chat_id)
+                    if progress is not None:
+                        progress.message_id = None
+                        progress.lines = []
+            except Exception as e:
+                logger.error(f"Errore durante l'invio alla chat {chat_id}: {e}")
+            finally:
+                queue.task_done()
+
+    async def _flush_progress(self, chat_id):
+        await asyncio.sleep(self.coalesce_delay)
+        progress = self._progress.get(chat_id)
+        if progress is None or not progress.pending:
+            return
+        new_lines, progress.pending, progress.scheduled = progress.pending, [], False
+
+        text = "\n".join(progress.lines + new_lines)
+        if progress.message_id is not None and len(text) <= MAX_MESSAGE_LENGTH:
+            try:
+                await self._call(chat_id, lambda: self.bot.edit_message_text(
+                    text=text, chat_id=chat_id, message_id=progress.message_id))
+                progress.lines.extend(new_lines)
+                return
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    progress.lines.extend(new_lines)
+                    return
+                # Messaggio eliminato o non più modificabile: le righe vengono inviate in un messaggio nuovo
+                logger.warning(f"Messaggio di avanzamento non aggiornabile nella chat {chat_id}: {e}")
+                new_lines = progress.lines + new_lines
+                progress.message_id = None
+
+        # Primo log della sequenza, messaggio troppo lungo o non più modificabile: se ne apre uno nuovo
+        progress.lines = new_lines
+        text = "\n".join(new_lines)[-MAX_MESSAGE_LENGTH:]
+        message = await self._call(chat_id, lambda: self.bot.send_message(chat_id=chat_id, text=text))
+        progress.message_id = message.message_id
+
+    def log(self, chat_id, text):
+        """Accoda una riga di log senza attendere l'invio."""
+        progress = self._progress.get(chat_id)
+        if progress is None:
+            progress = self._progress[chat_id] = _ProgressMessage()
+        progress.pending.append(text)
+        if not progress.scheduled:
+            progress.scheduled = True
+            self._queue_for(chat_id).put_nowait(None)
+
+    def submit(self, chat_id, factory):
+        """
+        Accoda una chiamata all'API di Telegram (`factory` restituisce la coroutine)
+        e restituisce un future con il risultato.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue_for(chat_id).put_nowait((factory, future))
+        return future
+
+    async def close(self, timeout=10.0):
+        """Attende l'invio dei messaggi in coda (al massimo `timeout` secondi) e chiude i worker."""
+        if timeout:
+            try:
+                await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues.values())), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Timeout durante lo svuotamento della coda di invio.")
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+        self._queues.clear()
+
+
+_dispatcher = None
+
+
+# Restituisce il dispatcher associato al bot, creandolo se necessario
+def get_dispatcher(bot):
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.bot is not bot:
+        _dispatcher = OutboundDispatcher(bot)
+    return _dispatcher
+
+
+# Svuota e chiude il dispatcher globale
+async def close_dispatcher(timeout=10.0):
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.close(timeout)
+        _dispatcher = None
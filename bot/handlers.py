@@ -1,12 +1,62 @@
-import os
+import asyncio
+import functools
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from audio.audio_utils import clean_audio
 from openai_utils.openai_helper import transcribe_audio_with_whisper
+from bot.cache_utils import get_or_compute
+from bot.ingest import ingest_audio
+from bot.bot_utils import TelegramProgress
+from bot.batch import BATCH_MAX_ITEMS, batch_item_from_message, expand_items, run_batch, deliver_transcripts, deliver_cleaned
 from bot.config import logger
+from utils.workspace import get_workspace_manager, job_owner, WorkspaceQuotaError
+from utils.metrics import trace_job, span
+from utils.profile_store import get_profile_store
+from audio.encoding import DEFAULT_PROFILE, get_profile, is_opus
 
 TRANS_WAITING_FOR_AUDIO, TRANS_WAITING_FOR_FILENAME = range(2)
 CLEAN_WAITING_FOR_AUDIO, CLEAN_WAITING_FOR_FILENAME = range(2)
+BATCH_WAITING_FOR_FILES = 0
+NOISE_WAITING_FOR_SAMPLE = 0
+
+# Durata massima di un campione di rumore: ne viene analizzato solo l'inizio
+NOISE_SAMPLE_MAX_SECONDS = 5 * 60
+
+# Parametri che determinano il risultato, usati nella chiave della cache
+TRANSCRIBE_LANGUAGE = "it"
+TRANSCRIBE_CACHE_PARAMS = {'language': TRANSCRIBE_LANGUAGE}
+
+
+# Lo stack audio (numpy, scipy) viene importato al primo uso, non all'avvio del bot
+@functools.lru_cache(maxsize=None)
+def _clean_cache_params():
+    from audio.pipeline import DEFAULT_STEPS, resolve_params
+    return {'steps': list(DEFAULT_STEPS), 'params': resolve_params(), 'output_profile': DEFAULT_PROFILE}
+
+# Con un ambiente impostato il risultato dipende anche dal profilo di rumore salvato, e dalla sua versione
+async def _environment_cache_params(cache_params, user_id, environment):
+    if not environment:
+        return cache_params
+    revision = await asyncio.to_thread(get_profile_store().revision, user_id, environment)
+    return dict(cache_params, noise_profile=f"{user_id}:{environment}:{revision}")
+
+# Proprietario del workspace del job: /cancel interrompe solo i job dell'utente nella stessa chat
+def _job_owner(update):
+    return job_owner(update.effective_chat.id, update.effective_user.id)
+
+# Legge il contenuto di un file
+def _read_file(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+# Misura l'intera richiesta: durata, richieste attive e trace con gli span del job
+def _traced(kind):
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context):
+            with trace_job(kind, update.effective_user.id):
+                return await handler(update, context)
+        return wrapper
+    return decorator
 
 # Funzione per il comando /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -40,24 +90,44 @@ async def transcribe_handle_audio(update: Update, context: ContextTypes.DEFAULT_
         await update.message.reply_text("Non ho ricevuto un file audio. Riprova.")
         return TRANS_WAITING_FOR_AUDIO
 
-    # Usa `await` su `get_file()` perché è una coroutine
-    file = await audio_file.get_file()
-    file_path = await file.download_to_drive(custom_path="tmp/audio_to_transcribe.ogg")
-    context.user_data['transcribe_audio_file_path'] = file_path
-    logger.info(f"File audio salvato temporaneamente: {file_path}")
+    # Il download avviene solo se il risultato non è già in cache
+    context.user_data['transcribe_file_id'] = audio_file.file_id
+    context.user_data['transcribe_file_unique_id'] = audio_file.file_unique_id
+    context.user_data['transcribe_duration'] = audio_file.duration
 
     await update.message.reply_text("Grazie! Ora per favore, inviami il nome che vuoi assegnare alla trascrizione.")
     return TRANS_WAITING_FOR_FILENAME
 
 # Funzione per ricevere il nome del file e avviare la trascrizione
+@_traced('transcribe')
 async def transcribe_receive_filename(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Ricevuto nome file per trascrizione da {update.effective_user.first_name}.")
     filename = update.message.text.strip()
     context.user_data['transcribe_filename'] = filename
 
-    # Chiama la funzione di trascrizione (usa una funzione sincrona da openai_utils)
-    transcript = transcribe_audio_with_whisper(context.user_data['transcribe_audio_file_path'], language="it")
-    
+    # Chiama la funzione di trascrizione asincrona: l'event loop resta libero durante l'upload
+    async def transcribe(audio_input):
+        text = await transcribe_audio_with_whisper(audio_input.source, language=TRANSCRIBE_LANGUAGE,
+                                                   filename=audio_input.filename, duration=audio_input.duration)
+        return text.encode('utf-8') if text else None
+
+    # Ogni job lavora in un workspace dedicato, rimosso al termine in ogni caso
+    try:
+        async with get_workspace_manager().workspace(_job_owner(update)) as workspace:
+            result = await get_or_compute(
+                context.bot, 'transcript', TRANSCRIBE_CACHE_PARAMS,
+                context.user_data['transcribe_file_id'], context.user_data['transcribe_file_unique_id'],
+                workspace, transcribe, duration=context.user_data.get('transcribe_duration'),
+            )
+    except WorkspaceQuotaError as e:
+        logger.error(f"Trascrizione rifiutata: {e}")
+        await update.message.reply_text("Il server ha esaurito lo spazio temporaneo. Riprova tra qualche minuto.")
+        return ConversationHandler.END
+    except asyncio.CancelledError:
+        logger.info(f"Trascrizione annullata da {update.effective_user.first_name}.")
+        return ConversationHandler.END
+    transcript = result.decode('utf-8') if result else None
+
     if transcript:
         await update.message.reply_text(f"Trascrizione completata: {transcript}")
     else:
@@ -85,19 +155,17 @@ async def clean_handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Non ho ricevuto un file audio. Riprova.")
         return CLEAN_WAITING_FOR_AUDIO
 
-    # Usa `await` su `get_file()` perché è una coroutine
-    file = await audio_file.get_file()
-    
-    # Scarica il file audio utilizzando `await` su `download_to_drive`
-    file_path = await file.download_to_drive(custom_path="tmp/audio_to_clean.ogg")
-    context.user_data['clean_audio_file_path'] = file_path
-    logger.info(f"File audio salvato temporaneamente: {file_path}")
+    # Il download avviene solo se il risultato non è già in cache
+    context.user_data['clean_file_id'] = audio_file.file_id
+    context.user_data['clean_file_unique_id'] = audio_file.file_unique_id
+    context.user_data['clean_duration'] = audio_file.duration
 
     # Passa allo stato successivo per chiedere il nome del file
     await update.message.reply_text("Grazie! Ora per favore, inviami il nome che vuoi assegnare al file pulito.")
     return CLEAN_WAITING_FOR_FILENAME
 
 # Funzione per ricevere il nome del file e avviare la pulizia
+@_traced('clean')
 async def clean_receive_filename(update: Update, context: ContextTypes.DEFAULT_TYPE):
     filename = update.message.text.strip()
     context.user_data['clean_filename'] = filename
@@ -106,17 +174,47 @@ async def clean_receive_filename(update: Update, context: ContextTypes.DEFAULT_T
     user_id = update.effective_user.id
     bot = context.bot  # Passa il bot come argomento
 
-    # Avvia la pulizia dell'audio passando il bot e l'ID dell'utente
-    cleaned_audio_path = clean_audio(bot, context.user_data['clean_audio_file_path'], filename, user_id)
+    # Con un ambiente impostato il risultato dipende anche dal profilo di rumore dell'utente
+    from audio.audio_utils import clean_audio
+
+    environment = context.user_data.get('noise_environment')
+    cache_params = await _environment_cache_params(_clean_cache_params(), user_id, environment)
+
+    # Ogni job lavora in un workspace dedicato, rimosso al termine in ogni caso
+    try:
+        async with get_workspace_manager().workspace(_job_owner(update)) as workspace:
+            # Avvia la pulizia dell'audio passando il bot e l'ID dell'utente
+            async def clean(audio_input):
+                cleaned_audio_path = await clean_audio(audio_input.source, filename, output_dir=workspace.path,
+                                                       environment=environment, owner=user_id,
+                                                       progress=TelegramProgress(bot, user_id),
+                                                       duration=audio_input.duration)
+                if not cleaned_audio_path:
+                    return None
+                return await asyncio.to_thread(_read_file, cleaned_audio_path)
 
-    if cleaned_audio_path:
-        logger.info(f"Pulizia dell'audio completata per {update.effective_user.first_name}. File salvato in {cleaned_audio_path}.")
-        with open(cleaned_audio_path, 'rb') as audio_file:
-            await update.message.reply_audio(audio=audio_file)
+            cleaned_audio = await get_or_compute(
+                bot, 'clean', cache_params,
+                context.user_data['clean_file_id'], context.user_data['clean_file_unique_id'],
+                workspace, clean, duration=context.user_data.get('clean_duration'),
+            )
+    except WorkspaceQuotaError as e:
+        logger.error(f"Pulizia rifiutata: {e}")
+        await update.message.reply_text("Il server ha esaurito lo spazio temporaneo. Riprova tra qualche minuto.")
+        return ConversationHandler.END
+    except asyncio.CancelledError:
+        logger.info(f"Pulizia annullata da {update.effective_user.first_name}.")
+        return ConversationHandler.END
 
-        os.remove(cleaned_audio_path)
-        os.remove(context.user_data['clean_audio_file_path'])
-        logger.info(f"File audio temporaneo {cleaned_audio_path} rimosso.")
+    if cleaned_audio:
+        logger.info(f"Pulizia dell'audio completata per {update.effective_user.first_name}.")
+        output_name = f"{filename}_cleaned{get_profile(DEFAULT_PROFILE).extension}"
+        with span('upload'):
+            # L'audio Opus viene inviato come messaggio vocale, riproducibile direttamente nella chat
+            if is_opus(DEFAULT_PROFILE):
+                await update.message.reply_voice(voice=cleaned_audio, filename=output_name, caption=filename)
+            else:
+                await update.message.reply_audio(audio=cleaned_audio, filename=output_name)
     else:
         await update.message.reply_text("Si è verificato un errore durante la pulizia dell'audio.")
         logger.error("Errore durante la pulizia dell'audio.")
@@ -124,6 +222,184 @@ async def clean_receive_filename(update: Update, context: ContextTypes.DEFAULT_T
     return ConversationHandler.END
 
 
+# Funzione per il comando /environment: imposta l'ambiente di registrazione (es. l'aula)
+async def environment_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info(f"Comando /environment ricevuto da {update.effective_user.first_name}.")
+    if not context.args:
+        current = context.user_data.get('noise_environment')
+        if current:
+            await update.message.reply_text(f"Ambiente di registrazione attuale: {current}. Usa /environment <nome> per cambiarlo.")
+        else:
+            await update.message.reply_text("Nessun ambiente impostato. Usa /environment <nome> (es. /environment aula_magna).")
+        return
+
+    environment = " ".join(context.args).strip()
+    context.user_data['noise_environment'] = environment
+    await update.message.reply_text(
+        f"Ambiente impostato: {environment}. Il profilo di rumore verrà stimato sulla prossima pulizia e riutilizzato per i file successivi. "
+        "Per un profilo più accurato invia /noise_sample e una breve registrazione di solo rumore (l'aula senza voci)."
+    )
+
+# Funzione per il comando /noise_sample: chiede una registrazione di solo rumore dell'ambiente
+async def noise_sample_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info(f"Comando /noise_sample ricevuto da {update.effective_user.first_name}.")
+    environment = context.user_data.get('noise_environment')
+    if not environment:
+        await update.message.reply_text("Imposta prima un ambiente con /environment <nome> (es. /environment aula_magna).")
+        return ConversationHandler.END
+    await update.message.reply_text(
+        f"Inviami una registrazione di solo rumore di fondo per l'ambiente {environment} (qualche secondo, senza voci)."
+    )
+    return NOISE_WAITING_FOR_SAMPLE
+
+# Funzione per ricevere il campione di rumore e salvarne il profilo
+@_traced('noise_sample')
+async def noise_receive_sample(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    audio_file = update.message.audio or update.message.voice
+    if not audio_file:
+        await update.message.reply_text("Non ho ricevuto un file audio. Riprova.")
+        return NOISE_WAITING_FOR_SAMPLE
+    if audio_file.duration and audio_file.duration > NOISE_SAMPLE_MAX_SECONDS:
+        await update.message.reply_text(
+            f"Il campione è troppo lungo: bastano pochi secondi (al massimo {NOISE_SAMPLE_MAX_SECONDS // 60} minuti). Riprova."
+        )
+        return NOISE_WAITING_FOR_SAMPLE
+
+    from audio.audio_utils import learn_noise_profile
+
+    user_id = update.effective_user.id
+    environment = context.user_data.get('noise_environment')
+    try:
+        async with get_workspace_manager().workspace(_job_owner(update)) as workspace:
+            file = await context.bot.get_file(audio_file.file_id)
+            audio_input = await ingest_audio(file, workspace, duration=audio_file.duration)
+            saved = await learn_noise_profile(audio_input.source, environment, user_id)
+    except WorkspaceQuotaError as e:
+        logger.error(f"Campione di rumore rifiutato: {e}")
+        await update.message.reply_text("Il server ha esaurito lo spazio temporaneo. Riprova tra qualche minuto.")
+        return ConversationHandler.END
+    except asyncio.CancelledError:
+        logger.info(f"Campione di rumore annullato da {update.effective_user.first_name}.")
+        return ConversationHandler.END
+
+    if saved:
+        await update.message.reply_text(
+            f"Profilo di rumore salvato per l'ambiente {environment}: verrà usato per le prossime pulizie."
+        )
+    else:
+        await update.message.reply_text("Non sono riuscito a stimare il profilo di rumore da questo file. Riprova.")
+    return ConversationHandler.END
+
+
+########################
+# Elaborazione in batch #
+########################
+
+# Avvia la raccolta dei file per un batch di trascrizione o pulizia
+async def _start_batch(update: Update, context: ContextTypes.DEFAULT_TYPE, mode):
+    context.user_data['batch'] = {'mode': mode, 'items': [], 'media_group': None}
+    action = "trascrivere" if mode == 'transcribe' else "pulire"
+    await update.message.reply_text(
+        f"Inviami i file audio da {action}: anche più file insieme, un album o un archivio zip "
+        f"(massimo {BATCH_MAX_ITEMS} file). Quando hai finito invia /done."
+    )
+    return BATCH_WAITING_FOR_FILES
+
+# Funzione per il comando /batch_transcribe
+async def batch_transcribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info(f"Comando /batch_transcribe ricevuto da {update.effective_user.first_name}.")
+    return await _start_batch(update, context, 'transcribe')
+
+# Funzione per il comando /batch_clean
+async def batch_clean_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    logger.info(f"Comando /batch_clean ricevuto da {update.effective_user.first_name}.")
+    return await _start_batch(update, context, 'clean')
+
+# Funzione per ricevere un file del batch
+async def batch_receive_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    batch = context.user_data['batch']
+    item = batch_item_from_message(update.message, len(batch['items']) + 1)
+    if item is None:
+        await update.message.reply_text("Questo non è un file audio né un archivio zip. Riprova.")
+        return BATCH_WAITING_FOR_FILES
+    if len(batch['items']) >= BATCH_MAX_ITEMS:
+        await update.message.reply_text(f"Hai raggiunto il massimo di {BATCH_MAX_ITEMS} file. Invia /done per avviare l'elaborazione.")
+        return BATCH_WAITING_FOR_FILES
+
+    batch['items'].append(item)
+    # Per un album basta una sola conferma, non una per ogni file
+    media_group = update.message.media_group_id
+    if media_group is None or media_group != batch['media_group']:
+        batch['media_group'] = media_group
+        await update.message.reply_text("File ricevuto. Invia altri file o /done per avviare l'elaborazione.")
+    return BATCH_WAITING_FOR_FILES
+
+# Funzione per il comando /done: elabora tutti i file raccolti
+@_traced('batch')
+async def batch_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    batch = context.user_data.get('batch') or {'items': []}
+    if not batch['items']:
+        await update.message.reply_text("Non hai ancora inviato nessun file. Inviane almeno uno, oppure /cancel.")
+        return BATCH_WAITING_FOR_FILES
+    context.user_data.pop('batch', None)
+
+    user_id = update.effective_user.id
+    bot = context.bot
+    mode = batch['mode']
+    logger.info(f"Batch {mode} di {len(batch['items'])} elementi avviato da {update.effective_user.first_name}.")
+
+    environment = context.user_data.get('noise_environment')
+    if mode == 'transcribe':
+        kind, cache_params, title = 'transcript', TRANSCRIBE_CACHE_PARAMS, "Trascrizioni"
+    else:
+        from audio.audio_utils import clean_audio
+        kind, title = 'clean', "Audio puliti"
+        cache_params = await _environment_cache_params(_clean_cache_params(), user_id, environment)
+
+    # Tutto il batch lavora in un unico workspace, rimosso al termine in ogni caso
+    try:
+        async with get_workspace_manager().workspace(_job_owner(update)) as workspace:
+            # Funzione di calcolo del singolo file, la stessa di /transcribe e /clean
+            if mode == 'transcribe':
+                def make_compute(entry):
+                    async def transcribe(audio_input):
+                        text = await transcribe_audio_with_whisper(audio_input.source, language=TRANSCRIBE_LANGUAGE,
+                                                                   filename=audio_input.filename,
+                                                                   duration=audio_input.duration)
+                        return text.encode('utf-8') if text else None
+                    return transcribe
+            else:
+                def make_compute(entry):
+                    async def clean(audio_input):
+                        # Nessun messaggio per singolo file: l'avanzamento è quello del batch
+                        cleaned_audio_path = await clean_audio(audio_input.source, f"{entry.index:03d}_{entry.name}",
+                                                               output_dir=workspace.path, environment=environment,
+                                                               owner=user_id, duration=audio_input.duration)
+                        if not cleaned_audio_path:
+                            return None
+                        return await asyncio.to_thread(_read_file, cleaned_audio_path)
+                    return clean
+
+            entries = await expand_items(bot, batch['items'], workspace)
+            if not entries:
+                await update.message.reply_text("Non ho trovato file audio da elaborare.")
+                return ConversationHandler.END
+            results = await run_batch(bot, user_id, entries, workspace, kind, cache_params, make_compute, title)
+
+            if not any(result for _, result in results):
+                await update.message.reply_text("Non è stato possibile elaborare nessuno dei file inviati.")
+            elif mode == 'transcribe':
+                await deliver_transcripts(bot, user_id, results, workspace, title)
+            else:
+                await deliver_cleaned(bot, user_id, results, workspace, title)
+    except WorkspaceQuotaError as e:
+        logger.error(f"Batch rifiutato: {e}")
+        await update.message.reply_text("Il server ha esaurito lo spazio temporaneo. Riprova con meno file o tra qualche minuto.")
+    except asyncio.CancelledError:
+        logger.info(f"Batch annullato da {update.effective_user.first_name}.")
+    return ConversationHandler.END
+
+
 ##########################
 # Funzione di cancellazione #
 ##########################
@@ -131,5 +407,7 @@ async def clean_receive_filename(update: Update, context: ContextTypes.DEFAULT_T
 # Funzione per annullare la conversazione
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Conversazione annullata da {update.effective_user.first_name}.")
+    # Interrompe gli eventuali job in corso e ne rimuove i file temporanei
+    get_workspace_manager().cancel_owner(_job_owner(update))
     await update.message.reply_text('Operazione annullata.')
     return ConversationHandler.END
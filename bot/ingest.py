@@ -0,0 +1,63 @@
+# bot/ingest.py
+
+import asyncio
+import os
+from utils import logger
+from utils.cache import hash_bytes, hash_file
+from utils.metrics import DOWNLOAD_SECONDS, span
+
+# Sotto questa dimensione il file resta in memoria, sopra viene scritto nel workspace
+INGEST_SPILL_BYTES = int(os.getenv('INGEST_SPILL_MB', 20)) * 1024 * 1024
+
+
+class AudioInput:
+    """
+    Audio ricevuto da Telegram: in memoria (`data`) oppure su disco (`path`).
+    `source` può essere passato direttamente alle funzioni di elaborazione,
+    che accettano sia percorsi sia byte. `duration` è la durata in secondi
+    dichiarata da Telegram (None se non nota): evita di ricavarla con ffprobe,
+    che sui byte in memoria spesso non la conosce.
+    """
+
+    def __init__(self, data=None, path=None, filename="audio.ogg", duration=None):
+        self.data = data
+        self.path = path
+        self.filename = filename
+        self.duration = duration
+
+    @property
+    def in_memory(self):
+        return self.data is not None
+
+    @property
+    def source(self):
+        return self.data if self.in_memory else self.path
+
+    def hash(self):
+        return hash_bytes(self.data) if self.in_memory else hash_file(self.path)
+
+
+# Funzione per scaricare un file audio di Telegram in memoria o, se grande, su disco
+async def ingest_audio(file, workspace, filename="audio.ogg", spill_bytes=INGEST_SPILL_BYTES, duration=None):
+    """
+    Scarica il file di Telegram. I file piccoli (la maggior parte dei vocali)
+    restano in memoria e vengono passati a ffmpeg via stdin o inviati così come
+    sono all'API di trascrizione; oltre `spill_bytes` il file va nel workspace.
+    """
+    size = file.file_size or 0
+    if size and size <= spill_bytes:
+        with span('download', DOWNLOAD_SECONDS, storage='memory'):
+            data = bytes(await file.download_as_bytearray())
+        logger.info(f"File audio scaricato in memoria ({len(data)} byte).")
+        return AudioInput(data=data, filename=filename, duration=duration)
+
+    workspace.reserve(size)
+    with span('download', DOWNLOAD_SECONDS, storage='disk'):
+        path = await file.download_to_drive(custom_path=workspace.path_for(filename))
+    logger.info(f"File audio salvato temporaneamente: {path}")
+    return AudioInput(path=path, filename=filename, duration=duration)
+
+
+# Calcola l'hash del contenuto senza bloccare l'event loop
+async def hash_audio(audio_input):
+    return await asyncio.to_thread(audio_input.hash)
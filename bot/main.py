@@ -1,11 +1,23 @@
+import asyncio
+import importlib
 from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
-from bot.config import logger, get_openai_api_key, get_telegram_token, verify_ffmpeg
-from openai_utils.openai_helper import setup_openai
+from bot.config import logger, get_openai_api_key, get_telegram_token, verify_ffmpeg, get_executor_settings, get_whisper_settings, get_cache_settings, get_workspace_settings, get_bot_mode, get_webhook_settings, get_queue_settings, get_metrics_settings, get_startup_settings, get_profile_store_settings
+from utils.executor import configure_executor, get_executor
+from utils.cache import configure_cache
+from utils.profile_store import configure_profile_store
+from utils.workspace import configure_workspaces, get_workspace_manager
+from openai_utils.openai_helper import setup_openai, close_openai
+from bot.dispatcher import close_dispatcher
+from bot.persistence import SQLitePersistence
+from utils.update_queue import UpdateQueue
+from utils.metrics import start_metrics_server
 from bot.handlers import (
     TRANS_WAITING_FOR_AUDIO,
     TRANS_WAITING_FOR_FILENAME,
     CLEAN_WAITING_FOR_AUDIO,
     CLEAN_WAITING_FOR_FILENAME,
+    BATCH_WAITING_FOR_FILES,
+    NOISE_WAITING_FOR_SAMPLE,
     start,
     transcribe_command,
     clean_command,
@@ -13,72 +25,232 @@ from bot.handlers import (
     transcribe_handle_audio,
     transcribe_receive_filename,
     clean_handle_audio,
-    clean_receive_filename
+    clean_receive_filename,
+    environment_command,
+    noise_sample_command,
+    noise_receive_sample,
+    batch_transcribe_command,
+    batch_clean_command,
+    batch_receive_file,
+    batch_done
 )
 
-def main():
+# Moduli pesanti (numpy, scipy, python-docx) caricati dopo l'avvio, non sul percorso di /start
+MAIN_WARM_MODULES = ('audio.audio_utils', 'docx')
+# Moduli importati da ogni worker del process pool al suo avvio
+WORKER_WARM_MODULES = ('numpy', 'audio.audio_utils')
+# Moduli caricati nel forkserver e ereditati dai worker: senza dipendenze da utils (nessun thread)
+WORKER_PRELOAD_MODULES = ('numpy', 'scipy.signal', 'scipy.fft', 'audio.filters', 'audio.denoise')
+
+# Operazioni lente dell'avvio, eseguite in background mentre il bot risponde già agli update
+async def warm_up(settings):
+    try:
+        # Verifica la corretta configurazione di ffmpeg
+        await asyncio.to_thread(verify_ffmpeg)
+        if settings['warm_imports']:
+            for module in MAIN_WARM_MODULES:
+                await asyncio.to_thread(importlib.import_module, module)
+            logger.info("Moduli audio e documenti caricati.")
+        # I worker vengono creati dal forkserver, non da questo processo: nessun fork durante gli import
+        if settings['prefork']:
+            await get_executor().warm_up()
+    except Exception as e:
+        logger.error(f"Errore durante il preriscaldamento: {e}")
+
+# Avvia il reaper dei workspace orfani, il preriscaldamento e, se configurato, l'endpoint delle metriche
+async def start_background_tasks(application):
+    application.create_task(get_workspace_manager().run_reaper())
+    application.create_task(warm_up(get_startup_settings()))
+    settings = get_metrics_settings()
+    if settings['port']:
+        application.bot_data['metrics_runner'] = await start_metrics_server(settings['port'], settings['host'])
+
+# Rilascia process pool, coda di invio e sessione HTTP alla chiusura dell'applicazione
+async def shutdown_resources(application):
+    get_executor().shutdown(wait=False)
+    # Il client HTTP del bot è già chiuso: i messaggi ancora in coda vengono scartati
+    await close_dispatcher(timeout=0)
+    runner = application.bot_data.get('metrics_runner')
+    if runner is not None:
+        await runner.cleanup()
+    await close_openai()
+
+# Configura le risorse condivise usate dagli handler; restituisce False in caso di errore
+def setup_resources():
     try:
         logger.info("Configurazione di OpenAI in corso...")
         # Configura OpenAI
-        setup_openai(get_openai_api_key())
+        setup_openai(get_openai_api_key(), **get_whisper_settings())
         logger.info("OpenAI configurato correttamente.")
     except Exception as e:
         logger.error(f"Errore durante la configurazione di OpenAI: {e}")
-        return
+        return False
 
     try:
-        # Verifica la corretta configurazione di ffmpeg
-        logger.info("Verifica dell'installazione di ffmpeg in corso...")
-        verify_ffmpeg()
+        # Configura il process pool per l'elaborazione audio
+        max_workers, max_queued, timeout = get_executor_settings()
+        configure_executor(max_workers=max_workers, max_queued=max_queued, timeout=timeout,
+                           warm_modules=WORKER_WARM_MODULES, preload_modules=WORKER_PRELOAD_MODULES)
+    except Exception as e:
+        logger.error(f"Errore durante la configurazione dell'executor: {e}")
+        return False
+
+    try:
+        # Configura la cache persistente di trascrizioni e audio puliti
+        db_path, max_bytes = get_cache_settings()
+        configure_cache(db_path=db_path, max_bytes=max_bytes)
+    except Exception as e:
+        logger.error(f"Errore durante la configurazione della cache: {e}")
+        return False
+
+    try:
+        # Configura l'archivio dei profili di rumore per ambiente, separato dalla cache
+        configure_profile_store(db_path=get_profile_store_settings())
     except Exception as e:
-        logger.error(f"Errore durante la verifica di ffmpeg: {e}")
+        logger.error(f"Errore durante la configurazione dei profili di rumore: {e}")
+        return False
+
+    try:
+        # Configura i workspace temporanei isolati per ogni job
+        root, quota_bytes, max_age = get_workspace_settings()
+        manager = configure_workspaces(root=root, quota_bytes=quota_bytes, max_age=max_age)
+        logger.info(f"Workspace dei job in {manager.root}.")
+    except Exception as e:
+        logger.error(f"Errore durante la configurazione dei workspace: {e}")
+        return False
+
+    return True
+
+# Crea l'applicazione Telegram e registra gli handler
+def build_application(persistence, block=False):
+    """
+    Con `block=False` (polling) trascrizione e pulizia non bloccano gli update
+    delle altre chat. I worker usano `block=True`: ogni update viene elaborato
+    per intero prima di salvare lo stato e passare al successivo della chat.
+    Mentre un handler non bloccante è in corso la conversazione resta nello
+    stato WAITING, in cui PTB non considera i fallback: /cancel va registrato
+    anche lì per poter interrompere il job.
+    """
+    logger.info("Creazione dell'applicazione Telegram...")
+    application = (
+        Application.builder()
+        .token(get_telegram_token())
+        .persistence(persistence)
+        .post_init(start_background_tasks)
+        .post_shutdown(shutdown_resources)
+        .build()
+    )
+    logger.info("Applicazione Telegram creata con successo.")
+
+    # Handler per la trascrizione
+    logger.info("Registrazione dell'handler per la trascrizione...")
+    transcribe_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("transcribe", transcribe_command)],
+        states={
+            TRANS_WAITING_FOR_AUDIO: [MessageHandler(filters.AUDIO | filters.VOICE, transcribe_handle_audio)],
+            TRANS_WAITING_FOR_FILENAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, transcribe_receive_filename, block=block)],
+            ConversationHandler.WAITING: [CommandHandler("cancel", cancel)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="transcribe",
+        persistent=True
+    )
+
+    # Handler per la pulizia
+    logger.info("Registrazione dell'handler per la pulizia...")
+    clean_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("clean", clean_command)],
+        states={
+            CLEAN_WAITING_FOR_AUDIO: [MessageHandler(filters.AUDIO | filters.VOICE, clean_handle_audio)],
+            CLEAN_WAITING_FOR_FILENAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, clean_receive_filename, block=block)],
+            ConversationHandler.WAITING: [CommandHandler("cancel", cancel)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="clean",
+        persistent=True
+    )
+
+    # Handler per l'elaborazione in batch (più file, album o archivi zip)
+    logger.info("Registrazione dell'handler per l'elaborazione in batch...")
+    batch_conv_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler("batch_transcribe", batch_transcribe_command),
+            CommandHandler("batch_clean", batch_clean_command),
+        ],
+        states={
+            BATCH_WAITING_FOR_FILES: [
+                MessageHandler(filters.AUDIO | filters.VOICE | filters.Document.ALL, batch_receive_file),
+                CommandHandler("done", batch_done, block=block),
+            ],
+            ConversationHandler.WAITING: [CommandHandler("cancel", cancel)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="batch",
+        persistent=True
+    )
+
+    # Handler per il campione di rumore dell'ambiente di registrazione
+    logger.info("Registrazione dell'handler per il campione di rumore...")
+    noise_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("noise_sample", noise_sample_command)],
+        states={
+            NOISE_WAITING_FOR_SAMPLE: [MessageHandler(filters.AUDIO | filters.VOICE, noise_receive_sample, block=block)],
+            ConversationHandler.WAITING: [CommandHandler("cancel", cancel)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="noise",
+        persistent=True
+    )
+
+    # Aggiungi gli handler per le conversazioni
+    application.add_handler(transcribe_conv_handler)
+    application.add_handler(clean_conv_handler)
+    application.add_handler(batch_conv_handler)
+    application.add_handler(noise_conv_handler)
+
+    # Aggiungi l'handler per il comando /start
+    logger.info("Registrazione dell'handler per il comando /start...")
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("environment", environment_command))
+    return application
+
+def main():
+    mode = get_bot_mode()
+    queue_settings = get_queue_settings()
+
+    if mode == 'webhook':
+        # Il server webhook accoda soltanto: non servono OpenAI, ffmpeg né process pool
+        try:
+            from bot.webhook import run_webhook_server
+            queue = UpdateQueue(queue_settings['queue_path'], lease_seconds=queue_settings['lease_seconds'])
+            metrics = get_metrics_settings()
+            run_webhook_server(get_telegram_token(), queue, metrics_port=metrics['port'], metrics_host=metrics['host'],
+                               **get_webhook_settings())
+        except Exception as e:
+            logger.error(f"Errore durante l'avvio del server webhook: {e}")
+        return
+
+    if not setup_resources():
         return
 
     try:
-        # Crea l'applicazione Telegram
-        logger.info("Creazione dell'applicazione Telegram...")
-        application = Application.builder().token(get_telegram_token()).build()
-        logger.info("Applicazione Telegram creata con successo.")
+        persistence = SQLitePersistence(queue_settings['state_path'])
+        application = build_application(persistence, block=(mode == 'worker'))
     except Exception as e:
         logger.error(f"Errore durante la creazione dell'applicazione Telegram: {e}")
         return
 
     try:
-        # Handler per la trascrizione
-        logger.info("Registrazione dell'handler per la trascrizione...")
-        transcribe_conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("transcribe", transcribe_command)],
-            states={
-                TRANS_WAITING_FOR_AUDIO: [MessageHandler(filters.AUDIO | filters.VOICE, transcribe_handle_audio)],
-                TRANS_WAITING_FOR_FILENAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, transcribe_receive_filename)],
-            },
-            fallbacks=[CommandHandler("cancel", cancel)]
-        )
-
-        # Handler per la pulizia
-        logger.info("Registrazione dell'handler per la pulizia...")
-        clean_conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("clean", clean_command)],
-            states={
-                CLEAN_WAITING_FOR_AUDIO: [MessageHandler(filters.AUDIO | filters.VOICE, clean_handle_audio)],
-                CLEAN_WAITING_FOR_FILENAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, clean_receive_filename)],
-            },
-            fallbacks=[CommandHandler("cancel", cancel)]
-        )
-
-        # Aggiungi gli handler per le conversazioni
-        application.add_handler(transcribe_conv_handler)
-        application.add_handler(clean_conv_handler)
-
-        # Aggiungi l'handler per il comando /start
-        logger.info("Registrazione dell'handler per il comando /start...")
-        application.add_handler(CommandHandler("start", start))
-
-        # Avvia l'applicazione
-        logger.info("Avvio del bot in corso...")
-        application.run_polling()
-        logger.info("Bot avviato e in esecuzione.")
-        
+        if mode == 'worker':
+            from bot.worker import run_worker
+            queue = UpdateQueue(queue_settings['queue_path'], lease_seconds=queue_settings['lease_seconds'])
+            logger.info("Avvio del worker in corso...")
+            run_worker(application, queue, concurrency=queue_settings['concurrency'])
+        else:
+            # Avvia l'applicazione
+            logger.info("Avvio del bot in corso...")
+            application.run_polling()
+        logger.info("Bot arrestato.")
     except Exception as e:
         logger.error(f"Errore durante la configurazione e l'avvio del bot: {e}")
 
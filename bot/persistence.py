@@ -0,0 +1,187 @@
+# bot/persistence.py
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import telegram
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+from utils import logger
+
+DEFAULT_STATE_PATH = os.path.join("data", "state.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistenza condivisa di `user_data` e stati delle conversazioni su SQLite,
+    così che qualunque worker possa proseguire una conversazione iniziata da
+    un altro. I dati sono salvati in JSON (id dei file, nomi, ambiente).
+    """
+
+    def __init__(self, db_path=DEFAULT_STATE_PATH, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def _run(self, sql, params=()):
+        return await asyncio.to_thread(self._query, sql, params)
+
+    # Le chiavi delle conversazioni sono tuple (chat_id, user_id): vengono salvate come liste JSON
+    def load_conversation(self, name, key):
+        rows = self._query("SELECT state FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(list(key))))
+        return json.loads(rows[0][0]) if rows else None
+
+    async def get_user_data(self):
+        rows = await self._run("SELECT user_id, data FROM user_data")
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await self._run("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is None:
+            await self._run("DELETE FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(list(key))))
+        else:
+            await self._run(
+                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                (name, json.dumps(list(key)), json.dumps(new_state)),
+            )
+
+    async def update_user_data(self, user_id, data):
+        await self._run("INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)", (user_id, json.dumps(data)))
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        await self._run("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def refresh_user_data(self, user_id, user_data):
+        """Ricarica i dati dell'utente prima di ogni update: potrebbero essere stati modificati da un altro worker."""
+        rows = await self._run("SELECT data FROM user_data WHERE user_id = ?", (user_id,))
+        user_data.clear()
+        if rows:
+            user_data.update(json.loads(rows[0][0]))
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Versioni di python-telegram-bot in cui è verificata la struttura interna di ConversationHandler
+# usata da `refresh_conversations` (PTB non offre un'API pubblica per impostare lo stato)
+SUPPORTED_PTB_VERSIONS = ('20.0',)
+
+
+# Chiave della conversazione per l'update, costruita dagli attributi pubblici dell'handler
+def conversation_key(handler, update):
+    """Stessa chiave calcolata da ConversationHandler; None se l'update non la consente."""
+    key = []
+    if handler.per_chat:
+        if update.effective_chat is None:
+            return None
+        key.append(update.effective_chat.id)
+    if handler.per_user:
+        if update.effective_user is None:
+            return None
+        key.append(update.effective_user.id)
+    if handler.per_message:
+        query = update.callback_query
+        if query is None:
+            return None
+        key.append(query.inline_message_id or query.message.message_id)
+    return tuple(key)
+
+
+def _persistent_conversations(application):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler) and handler.persistent:
+                yield handler
+
+
+# Da chiamare all'avvio dei worker, dopo `application.initialize()` che carica gli stati
+def check_conversation_support(application):
+    """
+    Verifica che la versione di python-telegram-bot sia tra quelle supportate
+    e che ogni conversazione persistente esponga ancora il dizionario degli
+    stati usato da `refresh_conversations`. Solleva RuntimeError altrimenti:
+    meglio non avviare il worker che proseguire le conversazioni con stati
+    non aggiornati.
+    """
+    if telegram.__version__ not in SUPPORTED_PTB_VERSIONS:
+        raise RuntimeError(
+            f"python-telegram-bot {telegram.__version__} non supportato dai worker "
+            f"(versioni verificate: {', '.join(SUPPORTED_PTB_VERSIONS)})."
+        )
+    for handler in _persistent_conversations(application):
+        if not isinstance(getattr(getattr(handler, '_conversations', None), 'data', None), dict):
+            raise RuntimeError(f"Stato interno della conversazione '{handler.name}' non accessibile.")
+
+
+# Allinea gli stati delle conversazioni della chat dell'update con quelli salvati da altri worker
+async def refresh_conversations(application, update):
+    """Richiede una versione verificata da `check_conversation_support`."""
+    persistence = application.persistence
+    for handler in _persistent_conversations(application):
+        key = conversation_key(handler, update)
+        if key is None:
+            continue
+        state = await asyncio.to_thread(persistence.load_conversation, handler.name, key)
+        # Aggiornamento diretto del dizionario, senza segnarlo come modificato
+        if state is None:
+            handler._conversations.data.pop(key, None)
+        else:
+            handler._conversations.data[key] = state
+    logger.debug(f"Stati delle conversazioni aggiornati per l'update {update.update_id}.")
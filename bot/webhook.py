@@ -0,0 +1,72 @@
+# bot/webhook.py
+
+import asyncio
+import hmac
+from aiohttp import web
+from telegram import Bot, Update
+from utils import logger
+from utils.metrics import UPDATES_RECEIVED, start_metrics_server
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# Riceve un update da Telegram e lo salva nella coda persistente
+async def handle_update(request):
+    secret_token = request.app['secret_token']
+    if secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret_token):
+        return web.Response(status=403)
+    try:
+        payload = await request.json()
+        await asyncio.to_thread(request.app['queue'].put, payload)
+        UPDATES_RECEIVED.inc()
+    except Exception as e:
+        logger.error(f"Errore durante l'accodamento di un update: {e}")
+        # Con un codice di errore Telegram reinvia l'update più tardi
+        return web.Response(status=500)
+    return web.Response()
+
+
+async def handle_health(request):
+    pending = await asyncio.to_thread(request.app['queue'].pending)
+    return web.json_response({'status': 'ok', 'pending_updates': pending})
+
+
+# Crea l'applicazione aiohttp che espone l'endpoint del webhook
+def create_webhook_app(queue, path="telegram", secret_token=None):
+    app = web.Application()
+    app['queue'] = queue
+    app['secret_token'] = secret_token
+    app.router.add_post(f"/{path}", handle_update)
+    app.router.add_get("/healthz", handle_health)
+    return app
+
+
+# Registra l'URL del webhook presso Telegram
+async def register_webhook(token, url, secret_token=None):
+    bot = Bot(token)
+    async with bot:
+        await bot.set_webhook(url=url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+    logger.info(f"Webhook registrato su {url}.")
+
+
+# Avvia il server webhook: gli update vengono solo accodati, l'elaborazione è dei worker
+def run_webhook_server(token, queue, host="0.0.0.0", port=8080, path="telegram", url=None, secret_token=None,
+                       metrics_port=None, metrics_host="127.0.0.1"):
+    app = create_webhook_app(queue, path=path, secret_token=secret_token)
+    # Le metriche restano su un server locale separato, non sulla porta pubblica del webhook
+    if metrics_port:
+        async def start_metrics(_app):
+            _app['metrics_runner'] = await start_metrics_server(metrics_port, metrics_host)
+
+        async def stop_metrics(_app):
+            await _app['metrics_runner'].cleanup()
+        app.on_startup.append(start_metrics)
+        app.on_cleanup.append(stop_metrics)
+    if url:
+        async def on_startup(_app):
+            await register_webhook(token, url, secret_token)
+        app.on_startup.append(on_startup)
+    else:
+        logger.warning("WEBHOOK_URL non impostato: il webhook deve essere già registrato presso Telegram.")
+    logger.info(f"Server webhook in ascolto su {host}:{port}/{path}.")
+    web.run_app(app, host=host, port=port, print=None)
@@ -0,0 +1,105 @@
+# bot/worker.py
+
+import asyncio
+import contextlib
+import os
+import signal
+import socket
+import time
+from telegram import Update
+from bot.persistence import check_conversation_support, refresh_conversations
+from utils import logger
+from utils.workspace import get_workspace_manager, job_owner
+
+DEFAULT_POLL_INTERVAL = 0.5
+# Ogni quanto un update in lavorazione controlla se è arrivato un /cancel
+DEFAULT_CANCEL_POLL_INTERVAL = 1.0
+
+
+# Rinnova periodicamente la presa in carico finché l'update è in lavorazione e,
+# se nel frattempo lo stesso utente invia /cancel nella chat, interrompe il suo job
+async def _keep_lease(queue, update_id, worker_id, chat_id=None, user_id=None, claimed_at=None):
+    renew_every = queue.lease_seconds / 3
+    last_renew = time.monotonic()
+    while True:
+        await asyncio.sleep(min(DEFAULT_CANCEL_POLL_INTERVAL, renew_every))
+        if time.monotonic() - last_renew >= renew_every:
+            await asyncio.to_thread(queue.renew, update_id, worker_id)
+            last_renew = time.monotonic()
+        if chat_id is not None and user_id is not None and \
+                await asyncio.to_thread(queue.cancel_requested, chat_id, user_id, claimed_at):
+            # Il /cancel può essere elaborato da un altro worker: il job va interrotto qui
+            if get_workspace_manager().cancel_owner(job_owner(chat_id, user_id)):
+                logger.info(f"Update {update_id} interrotto da /cancel.")
+            claimed_at = time.time()
+
+
+# Elabora un update preso dalla coda con lo stato condiviso più recente
+async def process_queued_update(application, queue, worker_id, update_id, payload):
+    claimed_at = time.time()
+    lease = None
+    try:
+        update = Update.de_json(payload, application.bot)
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        user_id = update.effective_user.id if update.effective_user else None
+        lease = asyncio.create_task(_keep_lease(queue, update_id, worker_id, chat_id, user_id, claimed_at))
+        await refresh_conversations(application, update)
+        await application.process_update(update)
+        # Salva subito user_data e stato della conversazione per il prossimo worker
+        await application.update_persistence()
+        await asyncio.to_thread(queue.complete, update_id)
+    except Exception as e:
+        logger.error(f"Errore durante l'elaborazione dell'update {update_id}: {e}")
+        await asyncio.to_thread(queue.fail, update_id)
+    finally:
+        if lease is not None:
+            lease.cancel()
+
+
+async def _consume(application, queue, concurrency, poll_interval, stop_event):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    logger.info(f"Worker {worker_id} avviato ({concurrency} update in parallelo).")
+    while not stop_event.is_set():
+        await slots.acquire()
+        claimed = await asyncio.to_thread(queue.claim, worker_id)
+        if claimed is None:
+            slots.release()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop_event.wait(), poll_interval)
+            continue
+        task = asyncio.create_task(process_queued_update(application, queue, worker_id, *claimed))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        task.add_done_callback(lambda _: slots.release())
+    if tasks:
+        logger.info(f"Attesa della fine di {len(tasks)} update in lavorazione...")
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _run(application, queue, concurrency, poll_interval):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    # Senza accesso agli stati delle conversazioni (caricati da initialize) i worker non possono condividerle
+    check_conversation_support(application)
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        await _consume(application, queue, concurrency, poll_interval, stop_event)
+    finally:
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+# Avvia un worker che consuma la coda degli update al posto del polling
+def run_worker(application, queue, concurrency=8, poll_interval=DEFAULT_POLL_INTERVAL):
+    asyncio.run(_run(application, queue, concurrency, poll_interval))
@@ -1,29 +1,131 @@
-import openai
+import asyncio
+import os
 from bot.config import logger
+from openai_utils.whisper_client import OpenAIWhisperBackend, WhisperClient, TranscriptionError, DEFAULT_BASE_URL
+from audio.ffmpeg_io import probe_audio, describe_source
+from audio.encoding import matches_profile, transcode
+from audio.splitter import split_audio, export_chunk, MAX_UPLOAD_BYTES, DEFAULT_MAX_CHUNK_SECONDS
+from utils.executor import get_executor
+
+# Numero massimo di chunk esportati contemporaneamente con ffmpeg
+CHUNK_EXPORT_CONCURRENCY = os.cpu_count() or 1
+
+_whisper_client = None
 
 # Configura OpenAI
-def setup_openai(api_key):
+def setup_openai(api_key, base_url=None, max_in_flight=4, max_retries=4, timeout=120.0, backend=None):
+    global _whisper_client
     try:
-        openai.api_key = api_key
+        # Un backend alternativo (es. uno stub locale) può sostituire quello HTTP di OpenAI
+        if backend is None:
+            backend = OpenAIWhisperBackend(api_key, base_url=base_url or DEFAULT_BASE_URL, timeout=timeout,
+                                           max_connections=max_in_flight)
+        _whisper_client = WhisperClient(backend, max_in_flight=max_in_flight, max_retries=max_retries)
         logger.info("Chiave API di OpenAI configurata con successo.")
     except Exception as e:
         logger.error(f"Errore durante la configurazione della chiave API di OpenAI: {e}")
         raise
 
+# Restituisce il client di trascrizione condiviso
+def get_whisper_client():
+    if _whisper_client is None:
+        raise RuntimeError("Il client Whisper non è configurato: chiamare prima setup_openai().")
+    return _whisper_client
+
+# Chiude la sessione HTTP condivisa
+async def close_openai():
+    global _whisper_client
+    if _whisper_client is not None:
+        await _whisper_client.aclose()
+        _whisper_client = None
+
+# Legge i byte della sorgente: i file su disco vengono letti, quelli in memoria restituiti così come sono
+def _read_source(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    with open(source, 'rb') as audio_file:
+        return audio_file.read()
+
+# Dimensione in byte della sorgente
+def _source_size(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    return os.path.getsize(source)
+
+# Trascrive un singolo chunk, restituendo i segmenti con l'offset temporale del chunk
+async def _transcribe_chunk(source, chunk, language, export_semaphore):
+    async with export_semaphore:
+        audio = await asyncio.to_thread(export_chunk, source, chunk)
+    result = await get_whisper_client().transcribe(
+        audio, filename=f"chunk_{chunk.index:04d}.ogg", language=language, response_format="verbose_json"
+    )
+    segments = [
+        dict(segment, start=segment['start'] + chunk.start, end=segment['end'] + chunk.start)
+        for segment in result.get('segments', [])
+    ]
+    return result.get('text', "").strip(), segments
+
+# Trascrive registrazioni lunghe: taglio sui silenzi, chunk in parallelo e ricomposizione in ordine
+async def transcribe_long_audio(source, language="it", max_chunk_seconds=DEFAULT_MAX_CHUNK_SECONDS, duration=None):
+    """
+    Restituisce un dizionario con il testo completo ('text') e i segmenti
+    ('segments') con timestamp riferiti all'inizio della registrazione.
+    `source` è un percorso oppure i byte del file; `duration`, se nota, evita il probe.
+    """
+    if not duration:
+        _, _, duration = await asyncio.to_thread(probe_audio, source)
+    # L'analisi dei silenzi è CPU-bound: gira nel process pool
+    chunks = await get_executor().run(split_audio, source, duration, max_chunk_seconds)
+    logger.info(f"File {describe_source(source)} diviso in {len(chunks)} chunk per la trascrizione.")
+
+    export_semaphore = asyncio.Semaphore(CHUNK_EXPORT_CONCURRENCY)
+    results = await asyncio.gather(
+        *(_transcribe_chunk(source, chunk, language, export_semaphore) for chunk in chunks)
+    )
+    text = " ".join(chunk_text for chunk_text, _ in results if chunk_text)
+    segments = [segment for _, chunk_segments in results for segment in chunk_segments]
+    return {'text': text, 'segments': segments}
+
+# Prepara l'audio da inviare all'API: Opus mono 16 kHz, a meno che la sorgente non sia già così compatta
+def _prepare_upload(source, filename):
+    try:
+        if not matches_profile(source, 'transcription'):
+            return transcode(source, 'transcription'), "audio.ogg"
+    except Exception as e:
+        # In caso di errore si invia il file originale, che l'API accetta comunque
+        logger.warning(f"Conversione per la trascrizione non riuscita, invio del file originale: {e}")
+    return _read_source(source), filename
+
+# Verifica se il file va diviso in chunk prima della trascrizione
+def _needs_split(source, duration=None):
+    if _source_size(source) > MAX_UPLOAD_BYTES:
+        return True
+    if not duration:
+        _, _, duration = probe_audio(source)
+    return duration > DEFAULT_MAX_CHUNK_SECONDS
+
 # Funzione per trascrivere audio tramite Whisper
-def transcribe_audio_with_whisper(file_path, language="it"):
+async def transcribe_audio_with_whisper(source, language="it", filename=None, duration=None):
+    """
+    Trascrive `source`, un percorso oppure i byte del file: in quest'ultimo caso
+    i byte vengono inviati all'API direttamente, senza passare dal disco.
+    `duration` è la durata in secondi, se già nota (es. dichiarata da Telegram).
+    """
     try:
-        with open(file_path, 'rb') as audio_file:
-            # Nuovo formato della chiamata all'API Whisper
-            transcript = openai.Audio.translate(
-                model="whisper-1",
-                file=audio_file,
-                language=language
-            )
-            return transcript.get('text', "").strip()
-    except openai.OpenAIError as e:
-        logger.error(f"Errore OpenAI durante la trascrizione del file {file_path}: {e}")
+        # File lunghi o oltre il limite dell'API: trascrizione a chunk in parallelo
+        if await asyncio.to_thread(_needs_split, source, duration):
+            transcript = await transcribe_long_audio(source, language=language, duration=duration)
+            return transcript['text']
+
+        if filename is None:
+            filename = "audio.ogg" if isinstance(source, (bytes, bytearray, memoryview)) else os.path.basename(source)
+        # Meno byte da caricare: la conversione è un processo ffmpeg, fuori dall'event loop
+        audio, filename = await asyncio.to_thread(_prepare_upload, source, filename)
+        transcript = await get_whisper_client().transcribe(audio, filename=filename, language=language)
+        return transcript.get('text', "").strip()
+    except TranscriptionError as e:
+        logger.error(f"Errore OpenAI durante la trascrizione del file {describe_source(source)}: {e}")
         return None
     except Exception as e:
-        logger.error(f"Errore durante la trascrizione del file {file_path}: {e}")
+        logger.error(f"Errore durante la trascrizione del file {describe_source(source)}: {e}")
         return None
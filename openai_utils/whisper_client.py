@@ -0,0 +1,136 @@
+import abc
+import asyncio
+import random
+import time
+import httpx
+from bot.config import logger
+from utils.metrics import TRANSCRIPTION_REQUEST_SECONDS, current_trace
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_MODEL = "whisper-1"
+
+# Codici HTTP per cui ha senso ritentare la richiesta
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+# Converte l'header Retry-After (in secondi) in float, se presente e valido
+def _parse_retry_after(value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class TranscriptionError(Exception):
+    """Errore restituito da un backend di trascrizione."""
+
+    def __init__(self, message, status_code=None, retry_after=None, retryable=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        if retryable is None:
+            retryable = status_code in RETRYABLE_STATUS_CODES
+        self.retryable = retryable
+
+
+class TranscriptionBackend(abc.ABC):
+    """
+    Interfaccia dei backend di trascrizione. Un backend riceve i byte dell'audio
+    e restituisce un dizionario con almeno la chiave 'text'.
+    """
+
+    @abc.abstractmethod
+    async def transcribe(self, audio, filename, language=None, response_format="json"):
+        """Trascrive i byte `audio`; solleva TranscriptionError in caso di errore."""
+
+    async def aclose(self):
+        pass
+
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """
+    Backend HTTP compatibile con l'endpoint `/audio/transcriptions` di OpenAI.
+    Usa un'unica sessione httpx con pool di connessioni condiviso; `base_url`
+    può puntare a un server stub locale.
+    """
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, model=DEFAULT_MODEL, timeout=120.0, max_connections=10):
+        self.model = model
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def transcribe(self, audio, filename, language=None, response_format="json"):
+        data = {"model": self.model, "response_format": response_format}
+        if language:
+            data["language"] = language
+        try:
+            response = await self._client.post("/audio/transcriptions", data=data, files={"file": (filename, audio)})
+        except httpx.TimeoutException as e:
+            raise TranscriptionError(f"Timeout della richiesta di trascrizione: {e}", retryable=True) from e
+        except httpx.TransportError as e:
+            raise TranscriptionError(f"Errore di rete durante la trascrizione: {e}", retryable=True) from e
+
+        if response.status_code >= 400:
+            retry_after = response.headers.get("retry-after")
+            raise TranscriptionError(
+                f"Errore HTTP {response.status_code} dall'API di trascrizione: {response.text[:200]}",
+                status_code=response.status_code,
+                retry_after=_parse_retry_after(retry_after),
+            )
+        if response_format in ("json", "verbose_json"):
+            return response.json()
+        return {"text": response.text}
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class WhisperClient:
+    """
+    Client asincrono di trascrizione: limita le richieste contemporanee con un
+    semaforo e ritenta con backoff esponenziale sugli errori temporanei.
+    """
+
+    def __init__(self, backend, max_in_flight=4, max_retries=4, backoff_base=1.0, backoff_max=30.0):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    def _backoff(self, attempt, error):
+        if error.retry_after:
+            return min(error.retry_after, self.backoff_max)
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay * (0.5 + random.random() / 2)
+
+    @staticmethod
+    def _observe(start, outcome):
+        elapsed = time.perf_counter() - start
+        TRANSCRIPTION_REQUEST_SECONDS.observe(elapsed, outcome=outcome)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_span(f"transcription_request:{outcome}", elapsed)
+
+    async def transcribe(self, audio, filename="audio.ogg", language="it", response_format="json"):
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                try:
+                    result = await self.backend.transcribe(audio, filename, language=language, response_format=response_format)
+                    self._observe(start, 'ok')
+                    return result
+                except TranscriptionError as e:
+                    self._observe(start, 'retry' if e.retryable and attempt < self.max_retries else 'error')
+                    if not e.retryable or attempt == self.max_retries:
+                        raise
+                    delay = self._backoff(attempt, e)
+                    logger.warning(f"Trascrizione fallita ({e}), nuovo tentativo {attempt + 1}/{self.max_retries} tra {delay:.1f} s.")
+                    await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self.backend.aclose()
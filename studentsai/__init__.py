@@ -0,0 +1 @@
+from .cli import process_directory, find_audio_files, Manifest
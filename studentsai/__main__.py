@@ -0,0 +1,6 @@
+# studentsai/__main__.py
+
+from studentsai.cli import main
+
+if __name__ == '__main__':
+    raise SystemExit(main())
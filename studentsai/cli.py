@@ -0,0 +1,227 @@
+# studentsai/cli.py
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from audio.audio_utils import clean_audio
+from audio.ffmpeg_io import AUDIO_EXTENSIONS
+from audio.encoding import DEFAULT_PROFILE, PROFILES
+from audio.pipeline import DEFAULT_STEPS, validate_steps
+from utils import logger
+from utils.executor import configure_executor, get_executor
+from utils.progress import LoggerProgress
+
+MANIFEST_NAME = "manifest.jsonl"
+# Proprietario dei profili di rumore per ambiente creati dalla CLI
+CLI_OWNER = "cli"
+
+
+# Elenca i file audio di una directory (ricorsivamente), come percorsi relativi ordinati
+def find_audio_files(input_dir, exclude=None):
+    exclude = os.path.abspath(exclude) if exclude else None
+    files = []
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        # La directory di output può trovarsi dentro quella di input
+        dirnames[:] = sorted(d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) != exclude)
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in AUDIO_EXTENSIONS and not filename.startswith('.'):
+                files.append(os.path.relpath(os.path.join(dirpath, filename), input_dir))
+    return files
+
+
+# Nome base degli output di un file: include l'estensione della sorgente, così
+# `lezione.mp3` e `lezione.wav` nella stessa directory non si sovrascrivono
+def output_name(rel):
+    stem, extension = os.path.splitext(os.path.basename(rel))
+    return f"{stem}_{extension[1:].lower()}" if extension else stem
+
+
+class Manifest:
+    """
+    Registro (JSON lines) dei file elaborati nella directory di output. Un file
+    viene saltato se è già stato completato, non è cambiato (dimensione e data
+    di modifica), è stato elaborato con le stesse impostazioni (step, formato,
+    lingua) e il suo output esiste ancora.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Riga troncata da un'interruzione
+                    self.records[record['source']] = record
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def is_done(self, source, stat, output_dir, settings):
+        record = self.records.get(source)
+        return (
+            record is not None
+            and record['status'] == 'done'
+            and record['size'] == stat.st_size
+            and record['mtime'] == stat.st_mtime
+            and record.get('settings') == settings
+            and os.path.exists(os.path.join(output_dir, record['output']))
+        )
+
+    def record(self, source, stat, output, status, settings):
+        record = {'source': source, 'size': stat.st_size, 'mtime': stat.st_mtime, 'output': output,
+                  'status': status, 'settings': settings, 'time': time.time()}
+        self.records[source] = record
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+# Trascrive un file e scrive il testo accanto agli altri output
+async def _transcribe_to_file(source, target_dir, name, language, progress):
+    from openai_utils.openai_helper import transcribe_audio_with_whisper
+
+    await progress.log("Trascrizione iniziata.")
+    text = await transcribe_audio_with_whisper(source, language=language, filename=os.path.basename(source))
+    if not text:
+        return None
+    path = os.path.join(target_dir, f"{name}.txt")
+
+    def write():
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    await asyncio.to_thread(write)
+    await progress.log("Trascrizione completata.")
+    return path
+
+
+# Elabora tutti i file audio di una directory, saltando quelli già completati
+async def process_directory(command, input_dir, output_dir, jobs, steps=DEFAULT_STEPS, environment=None,
+                            language="it", force=False, progress_factory=LoggerProgress, output_profile=DEFAULT_PROFILE):
+    """
+    `command` è 'clean' o 'transcribe'. Gli output riproducono la struttura
+    delle sottodirectory di `input_dir` dentro `output_dir`. Fino a `jobs` file
+    sono elaborati contemporaneamente; la pulizia e la scrittura degli output
+    avvengono nei processi del pool. `progress_factory(percorso relativo)`
+    restituisce la destinazione dei messaggi di ogni file; `output_profile` è
+    il profilo di codifica dei file puliti (vedi `audio.encoding.PROFILES`).
+    Restituisce (file completati, file non riusciti, file saltati).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+    # Impostazioni che determinano l'output: se cambiano, i file vanno rielaborati
+    if command == 'clean':
+        settings = {'command': command, 'steps': list(validate_steps(steps)), 'format': output_profile,
+                    'environment': environment}
+    else:
+        settings = {'command': command, 'language': language}
+    files = find_audio_files(input_dir, exclude=output_dir)
+    stats = {rel: os.stat(os.path.join(input_dir, rel)) for rel in files}
+    todo = [rel for rel in files if force or not manifest.is_done(rel, stats[rel], output_dir, settings)]
+    skipped = len(files) - len(todo)
+    logger.info(f"{len(files)} file audio trovati in {input_dir}: {len(todo)} da elaborare, {skipped} già completati.")
+
+    slots = asyncio.Semaphore(jobs)
+    counters = {'done': 0, 'failed': 0}
+
+    async def process(rel):
+        async with slots:
+            source = os.path.join(input_dir, rel)
+            target_dir = os.path.join(output_dir, os.path.dirname(rel))
+            os.makedirs(target_dir, exist_ok=True)
+            name = output_name(rel)
+            progress = progress_factory(rel)
+            start = time.monotonic()
+            try:
+                if command == 'clean':
+                    output = await clean_audio(source, name, steps=steps, output_dir=target_dir,
+                                               environment=environment, owner=CLI_OWNER, progress=progress,
+                                               output_profile=output_profile)
+                else:
+                    output = await _transcribe_to_file(source, target_dir, name, language, progress)
+            except Exception as e:
+                logger.error(f"Errore durante l'elaborazione di {rel}: {e}")
+                output = None
+
+        status = 'done' if output else 'failed'
+        manifest.record(rel, stats[rel], os.path.relpath(output, output_dir) if output else None, status, settings)
+        counters[status] += 1
+        logger.info(f"[{counters['done'] + counters['failed']}/{len(todo)}] {rel}: "
+                    f"{'completato' if output else 'non riuscito'} in {time.monotonic() - start:.1f} s")
+
+    try:
+        await asyncio.gather(*(process(rel) for rel in todo))
+    finally:
+        manifest.close()
+    return counters['done'], counters['failed'], skipped
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m studentsai",
+        description="Elaborazione offline di registrazioni audio senza il bot Telegram.",
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    clean = subparsers.add_parser('clean', help="Pulisce tutti i file audio di una directory.")
+    clean.add_argument('--steps', default=",".join(DEFAULT_STEPS),
+                       help="Step di pulizia separati da virgola (default: %(default)s); vuoto per la sola conversione.")
+    clean.add_argument('--format', choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                       help="Profilo di codifica dei file puliti (default: %(default)s).")
+    clean.add_argument('--environment', help="Ambiente di registrazione per riutilizzare il profilo di rumore.")
+
+    transcribe = subparsers.add_parser('transcribe', help="Trascrive tutti i file audio di una directory.")
+    transcribe.add_argument('--language', default="it", help="Lingua delle registrazioni (default: %(default)s).")
+
+    for subparser in (clean, transcribe):
+        subparser.add_argument('input_dir', help="Directory con i file audio (anche in sottodirectory).")
+        subparser.add_argument('-o', '--output', help="Directory di output (default: <input_dir>_<comando>).")
+        subparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                               help="File elaborati in parallelo (default: numero di core).")
+        subparser.add_argument('--force', action='store_true', help="Rielabora anche i file già completati.")
+    return parser
+
+
+async def _run(args, output_dir):
+    try:
+        return await process_directory(
+            args.command, args.input_dir, output_dir, args.jobs,
+            steps=validate_steps([s for s in args.steps.split(",") if s]) if args.command == 'clean' else DEFAULT_STEPS,
+            environment=getattr(args, 'environment', None),
+            language=getattr(args, 'language', "it"),
+            force=args.force,
+            output_profile=getattr(args, 'format', DEFAULT_PROFILE),
+            progress_factory=lambda rel: LoggerProgress(prefix=f"[{rel}] "),
+        )
+    finally:
+        get_executor().shutdown(wait=True)
+        if args.command == 'transcribe':
+            from openai_utils.openai_helper import close_openai
+            await close_openai()
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.isdir(args.input_dir):
+        logger.error(f"La directory {args.input_dir} non esiste.")
+        return 2
+    output_dir = args.output or f"{os.path.normpath(args.input_dir)}_{args.command}"
+
+    if args.command == 'clean':
+        # Ogni file in elaborazione occupa al più un job del pool: la coda non si satura mai
+        configure_executor(max_workers=args.jobs, max_queued=args.jobs)
+    else:
+        from bot.config import get_openai_api_key, get_whisper_settings
+        from openai_utils.openai_helper import setup_openai, CHUNK_EXPORT_CONCURRENCY
+        # I file lunghi vengono divisi ed esportati a chunk, anche più job per file
+        configure_executor(max_workers=args.jobs, max_queued=args.jobs * (CHUNK_EXPORT_CONCURRENCY + 1))
+        setup_openai(get_openai_api_key(), **get_whisper_settings())
+
+    completed, failed, skipped = asyncio.run(_run(args, output_dir))
+    logger.info(f"Elaborazione terminata: {completed} completati, {failed} non riusciti, {skipped} saltati. Output in {output_dir}.")
+    return 1 if failed else 0
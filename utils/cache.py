@@ -0,0 +1,158 @@
+# utils/cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from .logging_config import logger
+from .metrics import CACHE_REQUESTS
+
+DEFAULT_CACHE_PATH = os.path.join("cache", "results.sqlite3")
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1GB
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS aliases (
+    alias TEXT PRIMARY KEY,
+    key TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+    kind TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+# Hash SHA-256 di un buffer di byte
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Hash SHA-256 di un file, letto a blocchi
+def hash_file(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Chiave di cache: tipo di risultato + identificativo dell'audio + parametri di elaborazione
+def make_key(kind, audio_id, params=None):
+    payload = json.dumps({'kind': kind, 'audio': audio_id, 'params': params or {}}, sort_keys=True, default=list)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache persistente su SQLite indicizzata per contenuto. Le voci più vecchie
+    (per ultimo accesso) vengono rimosse quando si supera `max_bytes`. Gli alias
+    (es. il `file_unique_id` di Telegram) puntano a una voce esistente.
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _record(self, kind, hit):
+        CACHE_REQUESTS.inc(kind=kind, result='hit' if hit else 'miss')
+        column = 'hits' if hit else 'misses'
+        self._conn.execute(
+            f"INSERT INTO stats (kind, {column}) VALUES (?, 1) "
+            f"ON CONFLICT(kind) DO UPDATE SET {column} = {column} + 1",
+            (kind,),
+        )
+
+    def get(self, key, kind):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._record(kind, row is not None)
+        logger.debug(f"Cache {kind}: {'hit' if row is not None else 'miss'} per la chiave {key[:12]}.")
+        return None if row is None else bytes(row[0])
+
+    def put(self, key, kind, value):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, kind, value, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, sqlite3.Binary(value), len(value), now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removed = 0
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._conn.execute("DELETE FROM aliases WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        logger.info(f"Cache: rimosse {removed} voci per rientrare nel limite di {self.max_bytes} byte.")
+
+    def add_alias(self, alias, key):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO aliases (alias, key) VALUES (?, ?)", (alias, key))
+
+    def resolve_alias(self, alias):
+        with self._lock:
+            row = self._conn.execute("SELECT key FROM aliases WHERE alias = ?", (alias,)).fetchone()
+        return None if row is None else row[0]
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT kind, hits, misses FROM stats").fetchall()
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            'entries': entries,
+            'bytes': size,
+            'kinds': {kind: {'hits': hits, 'misses': misses} for kind, hits, misses in rows},
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+
+
+# Configura la cache globale (da chiamare all'avvio del bot)
+def configure_cache(db_path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = ResultCache(db_path=db_path, max_bytes=max_bytes)
+    return _cache
+
+
+# Restituisce la cache globale, creandola con i valori di default se necessario
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
@@ -0,0 +1,229 @@
+# utils/executor.py
+
+import asyncio
+import functools
+import importlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .logging_config import logger
+from .metrics import (
+    EXECUTOR_QUEUE_WAIT_SECONDS,
+    EXECUTOR_RUN_SECONDS,
+    EXECUTOR_ACTIVE_JOBS,
+    EXECUTOR_QUEUED_JOBS,
+    EXECUTOR_REJECTED,
+    span,
+)
+
+# Valori di default: un worker per core, una coda pari al doppio dei worker
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+DEFAULT_JOB_TIMEOUT = 15 * 60
+# I worker non vengono creati con fork() dal processo del bot, che ha thread attivi (import in
+# background, scrittura dei log, asyncio.to_thread): un fork durante un import o con un lock
+# acquisito da un altro thread può bloccare il figlio. Il forkserver è un processo a thread
+# singolo da cui vengono creati i worker; dove non esiste si usa spawn.
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+class JobQueueFullError(Exception):
+    """Sollevata quando l'executor è saturo e non accetta altri job."""
+
+
+class JobTimeoutError(Exception):
+    """Sollevata quando un job supera il tempo massimo consentito."""
+
+
+# Eseguita all'avvio di ogni worker: importa in anticipo i moduli usati dai job
+def _import_modules(modules):
+    for module in modules:
+        importlib.import_module(module)
+
+
+def _ready():
+    return os.getpid()
+
+
+class JobExecutor:
+    """
+    Esegue funzioni CPU-bound in un `ProcessPoolExecutor` limitato, senza
+    bloccare l'event loop del bot. I job oltre `max_workers` attendono in coda
+    fino a `max_queued`; oltre questa soglia vengono rifiutati.
+    Ogni worker importa `warm_modules` all'avvio, così il primo job non paga
+    il caricamento dello stack audio. `preload_modules` vengono importati una
+    volta nel forkserver e ereditati dai worker: devono essere librerie che non
+    avviano thread all'import (numpy, scipy), non moduli che importano
+    `utils.logging_config`, il cui thread di scrittura renderebbe il forkserver
+    multi-thread.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_queued=None, timeout=DEFAULT_JOB_TIMEOUT, warm_modules=(),
+                 preload_modules=()):
+        self.max_workers = max_workers
+        self.max_queued = max_workers * 2 if max_queued is None else max_queued
+        self.timeout = timeout
+        self.warm_modules = tuple(warm_modules)
+        self.preload_modules = tuple(preload_modules)
+        self._pool = None
+        self._slots = None
+        self._pending = 0
+        self._running = 0
+        # Job in corso per pool, e pool ritirati dopo un timeout in attesa di essere terminati
+        self._inflight = {}
+        self._retired = set()
+
+    @property
+    def active_jobs(self):
+        return self._running
+
+    @property
+    def queued_jobs(self):
+        return self._pending - self._running
+
+    def _get_pool(self):
+        if self._pool is None:
+            context = multiprocessing.get_context(START_METHOD)
+            if START_METHOD == 'forkserver':
+                context.set_forkserver_preload(list(self.preload_modules))
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                             initializer=_import_modules, initargs=(self.warm_modules,))
+            logger.info(f"Process pool avviato con {self.max_workers} worker.")
+        return self._pool
+
+    # Un worker terminato in modo anomalo rende inutilizzabile l'intero pool: il prossimo job ne crea uno nuovo
+    def _discard_pool(self, pool):
+        if pool is not None and self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            logger.warning("Process pool non più utilizzabile: verrà ricreato al prossimo job.")
+
+    # Dopo un timeout il pool viene ritirato: i nuovi job vanno su un pool nuovo, quelli ancora in
+    # corso nel vecchio terminano normalmente e poi i suoi processi, compreso quello bloccato, vengono uccisi
+    def _retire_pool(self, pool):
+        if self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+            logger.warning("Process pool ritirato dopo un timeout: i nuovi job useranno un pool nuovo.")
+        self._retired.add(pool)
+        self._terminate_if_idle(pool)
+
+    def _terminate_if_idle(self, pool):
+        if pool not in self._retired or self._inflight.get(pool):
+            return
+        self._retired.discard(pool)
+        self._inflight.pop(pool, None)
+        # ProcessPoolExecutor non offre un'API pubblica per interrompere i worker
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+        logger.info("Processi del pool ritirato terminati.")
+
+    def _job_done(self, pool, future):
+        self._inflight.get(pool, set()).discard(future)
+        self._terminate_if_idle(pool)
+
+    def _release(self, future=None):
+        self._running -= 1
+        self._slots.release()
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """
+        Esegue `func(*args, **kwargs)` in un processo worker e ne attende il risultato.
+        """
+        if self._pending >= self.max_workers + self.max_queued:
+            EXECUTOR_REJECTED.inc(reason='queue_full')
+            raise JobQueueFullError("Troppi job in coda, riprova più tardi.")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+        name = getattr(func, '__name__', str(func))
+        self._pending += 1
+        try:
+            with span('executor_queue', EXECUTOR_QUEUE_WAIT_SECONDS):
+                await self._slots.acquire()
+            self._running += 1
+            pool = future = None
+            try:
+                loop = asyncio.get_running_loop()
+                start = time.perf_counter()
+                pool = self._get_pool()
+                future = loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+                future.add_done_callback(lambda _: EXECUTOR_RUN_SECONDS.observe(time.perf_counter() - start, function=name))
+                self._inflight.setdefault(pool, set()).add(future)
+                future.add_done_callback(functools.partial(self._job_done, pool))
+                # asyncio.wait non solleva eccezioni: un TimeoutError sollevato dal job non viene
+                # scambiato per il timeout dell'executor
+                done, _ = await asyncio.wait({future}, timeout=timeout or self.timeout)
+                if not done:
+                    EXECUTOR_REJECTED.inc(reason='timeout')
+                    logger.warning(f"Job {name} oltre il timeout di {timeout or self.timeout} s.")
+                    # Il worker bloccato non conta più tra i job in corso del pool: viene terminato
+                    # appena finiscono gli altri, e lo slot torna subito disponibile
+                    self._inflight[pool].discard(future)
+                    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    self._release()
+                    self._retire_pool(pool)
+                    raise JobTimeoutError("Il job ha superato il tempo massimo consentito.")
+                result = future.result()
+            except JobTimeoutError:
+                raise
+            except BaseException as e:
+                # Se l'invio al pool non è riuscito non c'è un future a cui legare il rilascio dello slot
+                if future is None:
+                    self._release()
+                else:
+                    future.add_done_callback(self._release)
+                if isinstance(e, BrokenProcessPool):
+                    self._discard_pool(pool)
+                raise
+            self._release()
+            return result
+        finally:
+            self._pending -= 1
+
+    async def warm_up(self):
+        """
+        Avvia subito tutti i worker del pool (pre-fork), invece di crearli al
+        primo job. Un job per worker, inviati insieme, forza l'avvio di ognuno.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        pool = self._get_pool()
+        pids = await asyncio.gather(*(loop.run_in_executor(pool, _ready) for _ in range(self.max_workers)))
+        logger.info(f"Process pool pronto: {len(set(pids))} worker avviati in {time.perf_counter() - start:.2f} s.")
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+            logger.info("Process pool arrestato.")
+        for pool in list(self._retired):
+            self._inflight.pop(pool, None)
+            self._terminate_if_idle(pool)
+
+
+_executor = None
+
+
+# Configura l'executor globale (da chiamare all'avvio del bot)
+def configure_executor(max_workers=DEFAULT_MAX_WORKERS, max_queued=None, timeout=DEFAULT_JOB_TIMEOUT, warm_modules=(),
+                       preload_modules=()):
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+    _executor = JobExecutor(max_workers=max_workers, max_queued=max_queued, timeout=timeout, warm_modules=warm_modules,
+                            preload_modules=preload_modules)
+    return _executor
+
+
+# Restituisce l'executor globale, creandolo con i valori di default se necessario
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = JobExecutor()
+    return _executor
+
+
+EXECUTOR_ACTIVE_JOBS.set_function(lambda: _executor.active_jobs if _executor is not None else 0)
+EXECUTOR_QUEUED_JOBS.set_function(lambda: _executor.queued_jobs if _executor is not None else 0)
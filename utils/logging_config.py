@@ -1,37 +1,174 @@
+import atexit
+import json
 import logging
+import multiprocessing
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # Definisci la configurazione del logger
-LOG_FILE_PATH = os.path.join(os.path.dirname(__file__), 'bot.log')
+LOG_FILE_PATH = os.getenv('LOG_FILE', os.path.join(os.path.dirname(__file__), 'bot.log'))
 
-# Definisci il formato del log
-LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Definisci il formato delle righe di log testuali (la variabile d'ambiente LOG_FORMAT sceglie text o json)
+LOG_LINE_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
 # Dimensione massima del file di log in byte (es. 5MB)
 MAX_LOG_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 BACKUP_COUNT = 5  # Mantieni fino a 5 file di log di backup
 
-def setup_logging(log_level=logging.INFO):
-    """Configura il logger globale."""
+# Campionamento dei messaggi per utente: al massimo SAMPLE_BURST righe INFO/DEBUG
+# per utente ogni SAMPLE_WINDOW secondi (WARNING ed errori non vengono mai scartati)
+SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', 20))
+SAMPLE_WINDOW = float(os.getenv('LOG_SAMPLE_WINDOW', 60))
+
+# Attributi standard dei LogRecord, esclusi dai campi extra dell'output JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON per record, con i campi passati tramite `extra`."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class UserSamplingFilter(logging.Filter):
+    """
+    Limita i messaggi ad alto volume legati a un utente (record con `user_id`
+    in `extra`, es. l'avanzamento delle elaborazioni). Il numero di righe
+    scartate viene riportato nel campo `suppressed` della riga successiva.
+    """
+
+    def __init__(self, burst=SAMPLE_BURST, window=SAMPLE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        user_id = getattr(record, 'user_id', None)
+        if user_id is None or record.levelno >= logging.WARNING or self.burst <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            start, count, suppressed = self._windows.get(user_id, (now, 0, 0))
+            if now - start >= self.window:
+                start, count = now, 0
+            if count >= self.burst:
+                self._windows[user_id] = (start, count, suppressed + 1)
+                return False
+            self._windows[user_id] = (start, count + 1, 0)
+            # Le finestre scadute vengono rimosse per non crescere con il numero di utenti
+            if len(self._windows) > 10000:
+                self._windows = {key: value for key, value in self._windows.items() if now - value[0] < self.window}
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+def _build_handlers(json_format, log_file):
+    formatter = JsonFormatter() if json_format else logging.Formatter(LOG_LINE_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        # Definisci l'handler per il file di log con rotazione
+        handlers.append(RotatingFileHandler(log_file, maxBytes=MAX_LOG_FILE_SIZE, backupCount=BACKUP_COUNT))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+# Processo avviato da multiprocessing (es. un worker del process pool). Il nome viene impostato
+# prima dell'import del modulo principale nel figlio, parent_process() solo dopo
+def _in_child_process():
+    return multiprocessing.current_process().name != 'MainProcess' or multiprocessing.parent_process() is not None
+
+
+# Nei processi figli non c'è il thread di scrittura: si scrive direttamente, visto che lì non
+# gira l'event loop, e solo su console. Il file di log resta del processo principale: più
+# processi che scrivono e ruotano lo stesso file perderebbero o mescolerebbero i record.
+def _after_fork_in_child():
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for handler in _listener.handlers:
+        if isinstance(handler, logging.FileHandler):
+            continue
+        for log_filter in _queue_handler.filters:
+            handler.addFilter(log_filter)
+        root.addHandler(handler)
+    _listener, _queue_handler = None, None
+
+
+def stop_logging():
+    """Scrive i record ancora in coda e arresta il thread di scrittura."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def setup_logging(log_level=None, json_format=None, log_file=LOG_FILE_PATH):
+    """
+    Configura il logger globale. I record vengono solo accodati da chi li
+    emette (anche dall'event loop) e scritti su console e file da un thread
+    dedicato. Nei processi figli (worker del pool avviati da forkserver o
+    spawn) si scrive direttamente e solo su console.
+    """
+    global _listener, _queue_handler
+    if log_level is None:
+        log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    if json_format is None:
+        json_format = os.getenv('LOG_FORMAT', 'text').lower() == 'json'
+
     # Crea il logger
     logger = logging.getLogger()
     logger.setLevel(log_level)
 
-    # Definisci l'handler per il file di log con rotazione
-    file_handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=MAX_LOG_FILE_SIZE, backupCount=BACKUP_COUNT)
-    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
-
-    # Definisci l'handler per la console (stream)
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    # Una nuova configurazione sostituisce la precedente
+    stop_logging()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
 
-    # Aggiungi gli handler al logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if _in_child_process():
+        for handler in _build_handlers(json_format, None):
+            handler.addFilter(UserSamplingFilter())
+            logger.addHandler(handler)
+        return logger
 
+    log_queue = queue.SimpleQueue()
+    _queue_handler = QueueHandler(log_queue)
+    _queue_handler.addFilter(UserSamplingFilter())
+    _listener = QueueListener(log_queue, *_build_handlers(json_format, log_file), respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(_queue_handler)
     return logger
 
+
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
 # Configura il logging quando il modulo viene importato
 logger = setup_logging()
 
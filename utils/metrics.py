@@ -0,0 +1,319 @@
+# utils/metrics.py
+
+import bisect
+import contextlib
+import contextvars
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from .logging_config import logger
+
+# Limiti superiori (in secondi) dei bucket degli istogrammi di latenza
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+# Numero di trace completate mantenute in memoria per /traces
+MAX_TRACES = 200
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Etichette di {self.name}: attese {self.labelnames}, ricevute {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    """Contatore monotono (es. richieste, hit della cache)."""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Valore istantaneo (es. job attivi); può essere letto da una funzione al momento dell'esportazione."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            try:
+                self.set(self._function())
+            except Exception as e:
+                logger.error(f"Errore durante la lettura della metrica {self.name}: {e}")
+        return super().render()
+
+
+class Histogram(_Metric):
+    """Distribuzione di durate in bucket cumulativi, con somma e conteggio."""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            state['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_samples(self, items):
+        lines = []
+        for key, state in items:
+            cumulative = list(itertools.accumulate(state['counts']))
+            for bound, count in zip(self.buckets + (float('inf'),), cumulative):
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {cumulative[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Insieme delle metriche del processo, esportate nel formato testuale di Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Metriche dell'applicazione
+DOWNLOAD_SECONDS = REGISTRY.histogram(
+    "studentsai_download_seconds", "Durata del download dei file da Telegram.", ["storage"])
+STAGE_SECONDS = REGISTRY.histogram(
+    "studentsai_stage_seconds", "Durata degli step di elaborazione audio (decodifica, DSP, codifica).", ["stage"])
+JOB_SECONDS = REGISTRY.histogram(
+    "studentsai_job_seconds", "Durata complessiva delle richieste degli utenti.", ["kind"])
+ACTIVE_JOBS = REGISTRY.gauge(
+    "studentsai_active_jobs", "Richieste degli utenti in corso.", ["kind"])
+EXECUTOR_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "studentsai_executor_queue_wait_seconds", "Attesa di un worker libero nel process pool.")
+EXECUTOR_RUN_SECONDS = REGISTRY.histogram(
+    "studentsai_executor_run_seconds", "Durata dei job nel process pool.", ["function"])
+EXECUTOR_ACTIVE_JOBS = REGISTRY.gauge(
+    "studentsai_executor_active_jobs", "Job in esecuzione nel process pool.")
+EXECUTOR_QUEUED_JOBS = REGISTRY.gauge(
+    "studentsai_executor_queued_jobs", "Job in attesa di un worker del process pool.")
+EXECUTOR_REJECTED = REGISTRY.counter(
+    "studentsai_executor_rejected_total", "Job rifiutati dal process pool.", ["reason"])
+TRANSCRIPTION_REQUEST_SECONDS = REGISTRY.histogram(
+    "studentsai_transcription_request_seconds", "Latenza delle richieste all'API di trascrizione.", ["outcome"])
+CACHE_REQUESTS = REGISTRY.counter(
+    "studentsai_cache_requests_total", "Letture della cache dei risultati.", ["kind", "result"])
+UPDATES_RECEIVED = REGISTRY.counter(
+    "studentsai_webhook_updates_total", "Update ricevuti dal server webhook e accodati.")
+
+
+#####################
+# Trace per job     #
+#####################
+
+_current_trace = contextvars.ContextVar('studentsai_trace', default=None)
+_traces = deque(maxlen=MAX_TRACES)
+_trace_ids = itertools.count(1)
+
+
+class Trace:
+    """Span temporizzati di un singolo job (download, coda, step, upload...)."""
+
+    def __init__(self, kind, owner=None):
+        self.id = next(_trace_ids)
+        self.kind = kind
+        self.owner = owner
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def add_span(self, name, duration, start=None):
+        self.spans.append({'name': name, 'start': start, 'duration': round(duration, 6)})
+
+    def to_dict(self):
+        return {'id': self.id, 'kind': self.kind, 'owner': self.owner, 'started': self.started,
+                'duration': self.duration, 'spans': self.spans}
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+# Misura un blocco di codice: osserva l'istogramma indicato e lo aggiunge alla trace corrente
+@contextlib.contextmanager
+def span(name, histogram=None, **labels):
+    trace = _current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if histogram is not None:
+            histogram.observe(elapsed, **labels)
+        if trace is not None:
+            trace.add_span(name, elapsed, start=round(start - trace._start, 6))
+
+
+# Misura un'intera richiesta dell'utente e ne raccoglie gli span
+@contextlib.contextmanager
+def trace_job(kind, owner=None):
+    trace = Trace(kind, owner)
+    token = _current_trace.set(trace)
+    ACTIVE_JOBS.inc(kind=kind)
+    try:
+        yield trace
+    finally:
+        ACTIVE_JOBS.dec(kind=kind)
+        _current_trace.reset(token)
+        trace.duration = round(time.perf_counter() - trace._start, 6)
+        JOB_SECONDS.observe(trace.duration, kind=kind)
+        _traces.append(trace)
+        logger.debug(f"Trace {kind}: {json.dumps(trace.to_dict())}", extra={'user_id': owner})
+
+
+def recent_traces():
+    return [trace.to_dict() for trace in list(_traces)]
+
+
+class StageTimer:
+    """Raccoglie la durata degli step in un processo worker, per riportarla al processo principale."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+# Registra nel processo principale le durate misurate da un worker
+def record_stage_timings(timings):
+    trace = _current_trace.get()
+    for stage, seconds in (timings or {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        if trace is not None:
+            trace.add_span(f"stage:{stage}", seconds)
+
+
+#####################
+# Endpoint HTTP     #
+#####################
+
+# Aggiunge /metrics e /traces a un'applicazione aiohttp
+def add_metrics_routes(app):
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def handle_traces(request):
+        return web.json_response(recent_traces())
+
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/traces", handle_traces)
+    return app
+
+
+# Avvia un server HTTP locale che espone le metriche; restituisce il runner da chiudere all'uscita
+async def start_metrics_server(port, host="127.0.0.1"):
+    from aiohttp import web
+
+    runner = web.AppRunner(add_metrics_routes(web.Application()))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metriche disponibili su http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,88 @@
+# utils/profile_store.py
+
+import os
+import sqlite3
+import threading
+import time
+from .logging_config import logger
+
+DEFAULT_PROFILE_STORE_PATH = os.path.join("data", "noise_profiles.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS noise_profiles (
+    owner TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    data BLOB NOT NULL,
+    source TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (owner, environment)
+);
+"""
+
+
+class ProfileStore:
+    """
+    Profili di rumore per utente e ambiente di registrazione (es. un'aula), su
+    SQLite. A differenza della cache dei risultati le voci non vengono mai
+    rimosse per fare spazio: un profilo resta finché non viene sostituito.
+    `source` indica come è stato ottenuto ('sample' per un campione di solo
+    rumore inviato dall'utente, 'estimated' se stimato da una registrazione).
+    """
+
+    def __init__(self, db_path=DEFAULT_PROFILE_STORE_PATH):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, owner, environment):
+        """Restituisce (byte del profilo, versione) oppure None se il profilo non esiste."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, updated FROM noise_profiles WHERE owner = ? AND environment = ?",
+                (str(owner), environment),
+            ).fetchone()
+        return None if row is None else (bytes(row[0]), row[1])
+
+    def revision(self, owner, environment):
+        """Versione del profilo (istante dell'ultimo salvataggio), None se non esiste."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated FROM noise_profiles WHERE owner = ? AND environment = ?", (str(owner), environment)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, owner, environment, data, source='estimated'):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO noise_profiles (owner, environment, data, source, updated) VALUES (?, ?, ?, ?, ?)",
+                (str(owner), environment, sqlite3.Binary(data), source, time.time()),
+            )
+        logger.debug(f"Profilo di rumore salvato per {owner}, ambiente '{environment}' ({source}).")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_store = None
+
+
+# Configura l'archivio globale dei profili di rumore (da chiamare all'avvio del bot)
+def configure_profile_store(db_path=DEFAULT_PROFILE_STORE_PATH):
+    global _store
+    if _store is not None:
+        _store.close()
+    _store = ProfileStore(db_path=db_path)
+    return _store
+
+
+# Restituisce l'archivio globale dei profili, creandolo con i valori di default se necessario
+def get_profile_store():
+    global _store
+    if _store is None:
+        _store = ProfileStore()
+    return _store
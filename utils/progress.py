@@ -0,0 +1,29 @@
+# utils/progress.py
+
+import abc
+from .logging_config import logger
+
+
+class ProgressSink(abc.ABC):
+    """Destinazione dei messaggi di avanzamento di un'elaborazione."""
+
+    @abc.abstractmethod
+    async def log(self, message):
+        """Riceve un messaggio di avanzamento; non deve bloccare l'elaborazione."""
+
+
+class NullProgress(ProgressSink):
+    """Scarta i messaggi (es. file elaborati in batch)."""
+
+    async def log(self, message):
+        pass
+
+
+class LoggerProgress(ProgressSink):
+    """Scrive i messaggi nel log, con un prefisso opzionale (es. il nome del file)."""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+
+    async def log(self, message):
+        logger.info(f"{self.prefix}{message}")
@@ -0,0 +1,189 @@
+# utils/update_queue.py
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from .logging_config import logger
+
+DEFAULT_QUEUE_PATH = os.path.join("data", "updates.sqlite3")
+# Un update preso in carico e non rinnovato entro questo tempo torna disponibile (worker caduto)
+DEFAULT_LEASE_SECONDS = 120.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS updates (
+    update_id INTEGER PRIMARY KEY,
+    chat_id INTEGER,
+    payload TEXT NOT NULL,
+    claimed_by TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS updates_chat ON updates (chat_id, update_id);
+CREATE TABLE IF NOT EXISTS cancellations (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    requested REAL NOT NULL,
+    PRIMARY KEY (chat_id, user_id)
+);
+"""
+
+
+# Chat a cui appartiene un update grezzo di Telegram (None se non è legato a una chat)
+def update_chat_id(payload):
+    for value in payload.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat.get('id')
+        sender = value.get('from')
+        if sender:
+            return sender.get('id')
+    return None
+
+
+# Utente che ha inviato un update grezzo di Telegram (None se non ha un mittente)
+def update_user_id(payload):
+    for value in payload.values():
+        if isinstance(value, dict) and value.get('from'):
+            return value['from'].get('id')
+    return None
+
+
+# Verifica se l'update è un comando /cancel (anche nella forma /cancel@nome_bot)
+def is_cancel_command(payload):
+    text = (payload.get('message') or {}).get('text') or ''
+    command = text.split(maxsplit=1)[0] if text.strip() else ''
+    return command.split('@', 1)[0] == '/cancel'
+
+
+class UpdateQueue:
+    """
+    Coda persistente degli update di Telegram su SQLite, condivisa tra il server
+    webhook e i worker. Gli update della stessa chat vengono consegnati uno alla
+    volta e in ordine, quelli di chat diverse in parallelo a worker diversi.
+    Fa eccezione /cancel: non attende gli update precedenti della chat e
+    registra una richiesta di annullamento letta dal worker che sta
+    elaborando il job (`cancel_requested`).
+    """
+
+    def __init__(self, db_path=DEFAULT_QUEUE_PATH, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        # Code create prima dell'introduzione della priorità
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(updates)")}
+        if 'priority' not in columns:
+            self._conn.execute("ALTER TABLE updates ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        # Le richieste di annullamento valgono solo per i job in corso: la vecchia tabella, solo per
+        # chat, può essere ricreata senza migrarne il contenuto
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cancellations)")}
+        if 'user_id' not in columns:
+            self._conn.execute("DROP TABLE cancellations")
+            self._conn.executescript(_SCHEMA)
+
+    def put(self, payload):
+        """Accoda un update; gli update già ricevuti (reinvii di Telegram) vengono ignorati."""
+        chat_id = update_chat_id(payload)
+        user_id = update_user_id(payload)
+        cancel = is_cancel_command(payload)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO updates (update_id, chat_id, payload, created, priority) VALUES (?, ?, ?, ?, ?)",
+                (payload['update_id'], chat_id, json.dumps(payload), now, 1 if cancel else 0),
+            )
+            if cancel and chat_id is not None and user_id is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cancellations (chat_id, user_id, requested) VALUES (?, ?, ?)",
+                    (chat_id, user_id, now),
+                )
+
+    def claim(self, worker_id):
+        """
+        Prende in carico il primo update disponibile: il più vecchio della sua chat,
+        senza altri update della stessa chat in lavorazione. I /cancel hanno la
+        precedenza e non attendono gli update precedenti. Restituisce
+        (update_id, payload) oppure None se non c'è nulla da fare.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT update_id, payload FROM updates AS u
+                    WHERE (lease_until IS NULL OR lease_until < :now)
+                      AND (u.priority > 0 OR NOT EXISTS (
+                          SELECT 1 FROM updates AS o
+                          WHERE o.chat_id = u.chat_id AND o.update_id < u.update_id
+                      ))
+                    ORDER BY priority DESC, update_id LIMIT 1
+                    """,
+                    {'now': now},
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE updates SET claimed_by = ?, lease_until = ?, attempts = attempts + 1 WHERE update_id = ?",
+                        (worker_id, now + self.lease_seconds, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def renew(self, update_id, worker_id):
+        """Prolunga la presa in carico di un update ancora in lavorazione."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE updates SET lease_until = ? WHERE update_id = ? AND claimed_by = ?",
+                (time.time() + self.lease_seconds, update_id, worker_id),
+            )
+
+    def cancel_requested(self, chat_id, user_id, since):
+        """Verifica se l'utente ha inviato un /cancel nella chat dopo l'istante `since`."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM cancellations WHERE chat_id = ? AND user_id = ? AND requested > ?",
+                (chat_id, user_id, since),
+            ).fetchone()
+        return row is not None
+
+    def complete(self, update_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM updates WHERE update_id = ?", (update_id,))
+
+    def fail(self, update_id):
+        """Rilascia un update non elaborato; dopo `max_attempts` tentativi viene scartato."""
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM updates WHERE update_id = ?", (update_id,)).fetchone()
+            if row is None:
+                return
+            if row[0] >= self.max_attempts:
+                self._conn.execute("DELETE FROM updates WHERE update_id = ?", (update_id,))
+                logger.error(f"Update {update_id} scartato dopo {row[0]} tentativi falliti.")
+            else:
+                self._conn.execute(
+                    "UPDATE updates SET claimed_by = NULL, lease_until = NULL WHERE update_id = ?", (update_id,)
+                )
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM updates").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
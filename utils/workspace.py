@@ -0,0 +1,182 @@
+# utils/workspace.py
+
+import asyncio
+import contextlib
+import os
+import re
+import shutil
+import tempfile
+import time
+from .logging_config import logger
+
+DEFAULT_QUOTA_BYTES = 2 * 1024 * 1024 * 1024  # 2GB
+DEFAULT_MAX_AGE_SECONDS = 60 * 60
+DEFAULT_REAPER_INTERVAL_SECONDS = 5 * 60
+# Spazio libero minimo perché /dev/shm venga usato come radice (in Docker è di soli 64 MB di default)
+MIN_SHM_FREE_BYTES = 1024 * 1024 * 1024  # 1GB
+
+
+class WorkspaceQuotaError(Exception):
+    """Sollevata quando lo spazio dei workspace supera la quota configurata."""
+
+
+# Directory radice di default: tmpfs (/dev/shm) se disponibile e abbastanza grande, altrimenti tmp/
+def default_root(min_free=MIN_SHM_FREE_BYTES):
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        try:
+            if shutil.disk_usage("/dev/shm").free >= min_free:
+                return os.path.join("/dev/shm", "studentsai")
+        except OSError:
+            pass
+    return os.path.join("tmp", "workspaces")
+
+
+# Rende sicuro un nome di file scelto dall'utente
+def safe_filename(name, default="file"):
+    name = re.sub(r"[^\w.\- ]", "_", os.path.basename(str(name))).strip(" .")
+    return name or default
+
+
+# Proprietario dei workspace di un job: la stessa persona può avere job in più chat (privata,
+# gruppi) e /cancel deve interrompere solo quelli della chat da cui arriva
+def job_owner(chat_id, user_id):
+    return (chat_id, user_id)
+
+
+# Dimensione totale dei file contenuti in una directory
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+class Workspace:
+    """Directory temporanea dedicata a un singolo job."""
+
+    def __init__(self, manager, path, owner):
+        self.manager = manager
+        self.path = path
+        self.owner = owner
+        self.task = None
+
+    def path_for(self, name):
+        return os.path.join(self.path, safe_filename(name))
+
+    def reserve(self, nbytes):
+        """Verifica che ci sia spazio per altri `nbytes` prima di scrivere."""
+        self.manager.check_quota(nbytes)
+
+
+class WorkspaceManager:
+    """
+    Crea una directory isolata per ogni job e la rimuove alla fine del job,
+    in caso di errore o di /cancel. Un reaper in background elimina le
+    directory orfane più vecchie di `max_age`.
+    """
+
+    def __init__(self, root=None, quota_bytes=DEFAULT_QUOTA_BYTES, max_age=DEFAULT_MAX_AGE_SECONDS):
+        self.root = root or default_root()
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age
+        self._active = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def usage(self):
+        return directory_size(self.root)
+
+    def check_quota(self, extra_bytes=0):
+        used = self.usage()
+        if used + extra_bytes > self.quota_bytes:
+            raise WorkspaceQuotaError(
+                f"Quota dei workspace superata: {used + extra_bytes} byte su {self.quota_bytes} disponibili."
+            )
+        # La quota può superare lo spazio reale del filesystem (es. un tmpfs piccolo): si controlla anche quello
+        free = shutil.disk_usage(self.root).free
+        if extra_bytes > free:
+            raise WorkspaceQuotaError(
+                f"Spazio insufficiente in {self.root}: servono {extra_bytes} byte, liberi {free}."
+            )
+
+    def create(self, owner):
+        self.check_quota()
+        prefix = "_".join(map(str, owner)) if isinstance(owner, tuple) else owner
+        path = tempfile.mkdtemp(prefix=f"{safe_filename(prefix)}-", dir=self.root)
+        workspace = Workspace(self, path, owner)
+        self._active[path] = workspace
+        logger.debug(f"Workspace creato: {path}")
+        return workspace
+
+    def release(self, workspace):
+        self._active.pop(workspace.path, None)
+        shutil.rmtree(workspace.path, ignore_errors=True)
+        logger.debug(f"Workspace rimosso: {workspace.path}")
+
+    @contextlib.asynccontextmanager
+    async def workspace(self, owner):
+        """Context manager asincrono: il workspace viene rimosso in ogni caso all'uscita."""
+        workspace = self.create(owner)
+        workspace.task = asyncio.current_task()
+        try:
+            yield workspace
+        finally:
+            await asyncio.to_thread(self.release, workspace)
+
+    def cancel_owner(self, owner):
+        """Interrompe i job dell'utente e ne libera i workspace. Restituisce il numero di job annullati."""
+        cancelled = 0
+        for workspace in [w for w in self._active.values() if w.owner == owner]:
+            if workspace.task is not None and not workspace.task.done():
+                workspace.task.cancel()
+            else:
+                self.release(workspace)
+            cancelled += 1
+        return cancelled
+
+    def reap(self):
+        """Elimina le directory non più attive e più vecchie di `max_age`."""
+        now = time.time()
+        removed = 0
+        for entry in os.scandir(self.root):
+            if entry.path in self._active or not entry.is_dir():
+                continue
+            try:
+                if now - entry.stat().st_mtime < self.max_age:
+                    continue
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+        if removed:
+            logger.info(f"Reaper: rimossi {removed} workspace orfani da {self.root}.")
+        return removed
+
+    async def run_reaper(self, interval=DEFAULT_REAPER_INTERVAL_SECONDS):
+        while True:
+            try:
+                await asyncio.to_thread(self.reap)
+            except Exception as e:
+                logger.error(f"Errore durante la pulizia dei workspace orfani: {e}")
+            await asyncio.sleep(interval)
+
+
+_manager = None
+
+
+# Configura il gestore globale dei workspace (da chiamare all'avvio del bot)
+def configure_workspaces(root=None, quota_bytes=DEFAULT_QUOTA_BYTES, max_age=DEFAULT_MAX_AGE_SECONDS):
+    global _manager
+    _manager = WorkspaceManager(root=root, quota_bytes=quota_bytes, max_age=max_age)
+    return _manager
+
+
+# Restituisce il gestore globale dei workspace, creandolo con i valori di default se necessario
+def get_workspace_manager():
+    global _manager
+    if _manager is None:
+        _manager = WorkspaceManager()
+    return _manager